@@ -0,0 +1,251 @@
+import os
+import sys
+import math
+import time
+import json
+import random
+import argparse
+
+# Run from the repository root, python -m benchmarks.kernels
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame as pyg
+from main import Config, Sim, Boid, Boundary, Graph, Helper, MapBuilder, BoidSprites
+
+SEED = 1
+MIN_TIME = 0.2
+REPEATS = 5
+
+# Input sizes swept by each kernel, --quick only runs the first two
+SIZES = {"gather_neighbours": [150, 1000, 5000, 20000],
+         "check_collision": [10, 100, 1000, 10000],
+         "will_collide": [10, 100, 1000, 10000],
+         "lines_intersect": [1, 10, 100, 1000],
+         "batch_lines_intersect": [10, 100, 1000, 10000],
+         "dijkstra": [100, 1000, 5000, 20000],
+         "find_nearest_node": [10, 100, 1000, 10000],
+         "visibility_graph": [25, 50, 100, 200],
+         "boid_draw": [150, 1000, 5000, 20000],
+         "sprite_draw": [150, 1000, 5000, 20000]}
+
+def random_point(rng):
+    return pyg.math.Vector2(rng.uniform(0, Config.SCREEN_WIDTH), rng.uniform(0, Config.SCREEN_HEIGHT))
+
+def random_walls(rng, count):
+    walls = []
+    for i in range(count):
+        start = random_point(rng)
+        end = start + pyg.math.Vector2(rng.uniform(20, 120), 0).rotate(rng.uniform(0, 360))
+        walls.append(Boundary((start, end)))
+    return walls
+
+def random_boids(rng, sim, count):
+    boids = []
+    for i in range(count):
+        boid = Boid(sim)
+        boid.set_pos(random_point(rng))
+        boid.set_vel(pyg.math.Vector2(Config.MAX_SPEED, 0).rotate(rng.uniform(0, 360)))
+        boids.append(boid)
+    return boids
+
+def bench_gather_neighbours(rng, size):
+    sim = Sim(headless=True)
+    sim.create_boid_container(random_boids(rng, sim, size))
+    sim._Sim__rebuild_boid_grid()
+
+    boids = sim.get_boid_container()[:100]
+    def run():
+        for boid in boids:
+            boid._Boid__gather_neighbours()
+    return run, len(boids)
+
+def bench_check_collision(rng, size):
+    sim = Sim(headless=True)
+    walls = random_walls(rng, size)
+    boid = random_boids(rng, sim, 1)[0]
+    def run():
+        for wall in walls:
+            wall.check_collision(boid)
+    return run, size
+
+def bench_will_collide(rng, size):
+    sim = Sim(headless=True)
+    walls = random_walls(rng, size)
+    boid = random_boids(rng, sim, 1)[0]
+    def run():
+        for wall in walls:
+            wall.will_collide(boid)
+    return run, size
+
+def bench_lines_intersect(rng, size):
+    segments = [(random_point(rng), random_point(rng), random_point(rng), random_point(rng)) for i in range(size)]
+    def run():
+        for p1, p2, p3, p4 in segments:
+            Helper.lines_intersect(p1, p2, p3, p4)
+    return run, size
+
+def bench_batch_lines_intersect(rng, size):
+    starts, ends = Helper.segment_arrays(random_walls(rng, size))
+    p1 = np.array([[Config.SCREEN_WIDTH / 2, Config.SCREEN_HEIGHT / 2]])
+    p2 = p1 + 50
+    def run():
+        Helper.batch_lines_intersect(p1, p2, starts, ends)
+    return run, size
+
+def bench_dijkstra(rng, size):
+    graph = Graph()
+    ids = [graph.add_node(random_point(rng), 'destination') for i in range(size)]
+
+    # Each node joins its nearest handful so the graph stays sparse and connected in practice
+    positions = np.array([(node.get_pos().x, node.get_pos().y) for node in graph.get_all_nodes().values()])
+    cell = max(Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT) * 3 / math.sqrt(size)
+    order = np.argsort(positions[:, 0])
+    for rank, i in enumerate(order):
+        for j in order[rank + 1:rank + 40]:
+            if np.sum((positions[i] - positions[j]) ** 2) < cell ** 2:
+                graph.add_edge(ids[i], ids[j], True)
+
+    pairs = [(rng.choice(ids), rng.choice(ids)) for i in range(20)]
+    graph.dijkstra(*pairs[0])
+    def run():
+        for start, end in pairs:
+            graph.dijkstra(start, end)
+    return run, len(pairs)
+
+def bench_find_nearest_node(rng, size):
+    graph = Graph()
+    for i in range(size):
+        graph.add_node(random_point(rng), 'exit')
+
+    points = [random_point(rng) for i in range(100)]
+    def run():
+        for point in points:
+            graph.find_nearest_node(point, 'exit')
+    return run, len(points)
+
+def bench_visibility_graph(rng, size):
+    sim = Sim(headless=True)
+    builder = MapBuilder(sim)
+    graph = builder.get_builder_graph()
+
+    for i in range(size):
+        graph.add_node(random_point(rng), 'destination')
+    walls = random_walls(rng, size // 2)
+
+    def run():
+        for id in list(graph.get_all_nodes()):
+            for neighbour in list(graph.get_adjacency_list()[id]):
+                graph.remove_edge(id, neighbour)
+        builder.set_boundaries(walls)
+    return run, 1
+
+def bench_boid_draw(rng, size):
+    sim = Sim(headless=True)
+    boids = random_boids(rng, sim, size)
+    screen = pyg.Surface((Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT))
+    def run():
+        for boid in boids:
+            boid.draw(screen)
+    return run, 1
+
+def bench_sprite_draw(rng, size):
+    sim = Sim(headless=True)
+    boids = random_boids(rng, sim, size)
+    positions = np.array([(boid.get_pos().x, boid.get_pos().y) for boid in boids])
+    velocities = np.array([(boid.get_vel().x, boid.get_vel().y) for boid in boids])
+    sprites = BoidSprites()
+    screen = pyg.Surface((Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT))
+    def run():
+        sprites.draw(screen, positions, velocities)
+    return run, 1
+
+KERNELS = {"gather_neighbours": bench_gather_neighbours,
+           "check_collision": bench_check_collision,
+           "will_collide": bench_will_collide,
+           "lines_intersect": bench_lines_intersect,
+           "batch_lines_intersect": bench_batch_lines_intersect,
+           "dijkstra": bench_dijkstra,
+           "find_nearest_node": bench_find_nearest_node,
+           "visibility_graph": bench_visibility_graph,
+           "boid_draw": bench_boid_draw,
+           "sprite_draw": bench_sprite_draw}
+
+def time_callable(run, min_time=MIN_TIME, repeats=REPEATS):
+    # Grow the loop count until one batch takes min_time, then keep the best of several batches
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(loops):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+
+    best = elapsed
+    for i in range(repeats - 1):
+        start = time.perf_counter()
+        for i in range(loops):
+            run()
+        best = min(best, time.perf_counter() - start)
+
+    return best / loops
+
+def scaling_exponent(sizes, times):
+    # Slope of log(time) against log(size), 1 is linear and 0 is constant
+    if len(sizes) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(times), 1)[0])
+
+def run_kernel(name, sizes, min_time=MIN_TIME):
+    results = []
+    for size in sizes:
+        rng = random.Random(SEED)
+        run, calls = KERNELS[name](rng, size)
+        per_run = time_callable(run, min_time)
+        results.append({"size": size, "per_call": per_run / calls, "per_run": per_run})
+
+    per_run = [result["per_run"] for result in results]
+    return {"kernel": name, "results": results, "scaling": scaling_exponent(sizes, per_run)}
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:9.2f} us"
+    return f"{seconds * 1e3:9.2f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the simulation kernels on fixed synthetic inputs")
+    parser.add_argument("kernels", nargs="*", help=f"kernels to run, all by default: {', '.join(KERNELS)}")
+    parser.add_argument("--quick", action="store_true", help="only the two smallest sizes of each kernel")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME, help="seconds each timing batch should last")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.kernels if name not in KERNELS]
+    if unknown:
+        parser.error(f"unknown kernels: {', '.join(unknown)}")
+
+    # Builder buttons load images so the dummy display has to exist
+    pyg.init()
+    pyg.display.set_mode((1, 1))
+
+    reports = []
+    for name in args.kernels or list(KERNELS):
+        sizes = SIZES[name][:2] if args.quick else SIZES[name]
+        report = run_kernel(name, sizes, args.min_time)
+        reports.append(report)
+
+        print(name)
+        for result in report["results"]:
+            print(f"  n={result['size']:<7} {format_time(result['per_call'])} per call {format_time(result['per_run'])} per run")
+        if report["scaling"] is not None:
+            print(f"  scaling ~ n^{report['scaling']:.2f}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(reports, file, indent=4)
+
+if __name__ == "__main__":
+    main()
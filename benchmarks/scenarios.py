@@ -0,0 +1,216 @@
+import os
+import sys
+import time
+import json
+import random
+import platform
+import argparse
+import tempfile
+
+# Run from the repository root, python -m benchmarks.scenarios
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame as pyg
+from main import Config, Sim, Boid, Boundary, AssemblyPoint, Graph, Helper, JSONManager
+
+SEED = 1
+MAP_VERSION = 2 # Bump whenever build_map changes so cached maps are regenerated
+WALL_CLEARANCE = 80 # Walls are kept this far from the assembly point and exits so every scenario can be completed
+BOID_COUNTS = [150, 1000, 5000, 20000]
+WALL_COUNTS = [0, 100, 2000]
+STEPS = 20
+STEP_BUDGET = 200000 # Boid steps, small crowds run for longer so their timings aren't lost in noise
+FRAMES = 10
+THRESHOLD = 0.2
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+MAP_CACHE = os.path.join(tempfile.gettempdir(), "boids_benchmark_maps")
+
+def scenario_key(boids, walls, engine):
+    return f"{engine}/{boids}_boids/{walls}_walls"
+
+def build_map(path, boids, walls):
+    # Seeded random walls and boids with exits in each corner, saved the same way the map builder saves
+    rng = random.Random(SEED)
+    width, height = Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT
+
+    def random_point():
+        return pyg.math.Vector2(rng.uniform(20, width - 20), rng.uniform(20, height - 20))
+
+    corners = [(40, 40), (width - 40, 40), (40, height - 40), (width - 40, height - 40)]
+    keep_clear = [pyg.math.Vector2(width / 2, height / 2)] + [pyg.math.Vector2(corner) for corner in corners]
+
+    def clear_of_targets(start, end):
+        # Closest point on the wall to each target, redrawn if any is inside the clearance
+        wall = end - start
+        for point in keep_clear:
+            t = min(max((point - start).dot(wall) / wall.length_squared(), 0), 1)
+            if point.distance_to(start + wall * t) < WALL_CLEARANCE:
+                return False
+        return True
+
+    boundaries = []
+    while len(boundaries) < walls:
+        start = random_point()
+        end = start + pyg.math.Vector2(rng.uniform(10, 60), 0).rotate(rng.uniform(0, 360))
+        if clear_of_targets(start, end):
+            boundaries.append(Boundary((start, end)))
+
+    sim = Sim(headless=True)
+    boid_list = []
+    for i in range(boids):
+        boid = Boid(sim)
+        boid.set_pos(random_point())
+        boid_list.append(boid)
+
+    assembly = AssemblyPoint(pyg.math.Vector2(width / 2, height / 2))
+    graph = Graph()
+    ids = [graph.add_node(assembly.get_pos(), 'assembly')]
+    for corner in corners:
+        ids.append(graph.add_node(corner, 'exit'))
+
+    for i, id_a in enumerate(ids):
+        for id_b in ids[i + 1:]:
+            if Helper.clear_path(graph.get_node(id_a), graph.get_node(id_b), boundaries):
+                graph.add_edge(id_a, id_b, True)
+
+    success, error = JSONManager.save_map(path, boundaries, assembly, boid_list, None, graph.to_json())
+    if not success:
+        raise RuntimeError(error)
+
+def scenario_map(boids, walls):
+    os.makedirs(MAP_CACHE, exist_ok=True)
+    path = os.path.join(MAP_CACHE, f"scenario_{boids}_{walls}_{SEED}_v{MAP_VERSION}.json")
+
+    if not os.path.exists(path):
+        build_map(path, boids, walls)
+
+    return path
+
+def run_scenario(boids, walls, engine, steps=STEPS, frames=FRAMES):
+    path = scenario_map(boids, walls)
+    steps = max(steps, STEP_BUDGET // max(boids, 1))
+
+    sim = Sim(headless=True)
+    sim.set_engine(engine)
+    results = sim.run_headless(path, steps)
+    if "error" in results:
+        raise RuntimeError(results["error"])
+
+    # Frames are timed apart from steps, a frame costs one step plus one render
+    start = time.perf_counter()
+    for i in range(frames):
+        sim.render()
+    render_time = (time.perf_counter() - start) / frames
+    sim.close()
+
+    step_time = results["elapsed"] / results["steps"]
+    return {"key": scenario_key(boids, walls, engine), "boids": boids, "walls": walls, "engine": engine, "steps": steps,
+            "ms_per_step": step_time * 1000, "ms_per_render": render_time * 1000, "ms_per_frame": (step_time + render_time) * 1000,
+            "steps_per_second": results["steps_per_second"]}
+
+def cpu_name():
+    # platform.processor is empty on most Linux systems
+    try:
+        with open("/proc/cpuinfo", 'r') as file:
+            for line in file:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+
+    return platform.processor()
+
+def host_info():
+    # Steps per second are only comparable between runs on the same kind of machine
+    return {"system": platform.system(), "machine": platform.machine(), "cpu": cpu_name(), "cpus": os.cpu_count(),
+            "python": ".".join(platform.python_version_tuple()[:2])}
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None, {}
+
+    with open(path, 'r') as file:
+        stored = json.load(file)
+
+    return stored.get("host"), {result["key"]: result for result in stored["results"]}
+
+def host_mismatches(host, stored_host):
+    if stored_host is None:
+        return ["host not recorded"]
+
+    return [f"{key} {stored_host.get(key)!r} != {value!r}" for key, value in host.items() if stored_host.get(key) != value]
+
+def compare(results, baseline, threshold):
+    # A scenario regresses when its throughput drops more than threshold below the stored run
+    regressions = []
+    for result in results:
+        stored = baseline.get(result["key"])
+        if stored is None:
+            continue
+
+        change = (result["steps_per_second"] / stored["steps_per_second"]) - 1
+        result["change"] = change
+        if change < -threshold:
+            regressions.append(result)
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time Sim.step and frames on fixed scenarios and gate against a stored baseline")
+    parser.add_argument("--boids", type=int, nargs="+", default=BOID_COUNTS)
+    parser.add_argument("--walls", type=int, nargs="+", default=WALL_COUNTS)
+    parser.add_argument("--engine", choices=["object", "numpy", "parallel"], default=Config.ENGINE)
+    parser.add_argument("--steps", type=int, default=STEPS, help="minimum steps per scenario")
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="stored results to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed fractional drop in steps per second")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run in the baseline, replacing matching scenarios")
+    parser.add_argument("--ignore-host", action="store_true", help="compare against a baseline recorded on a different machine")
+    parser.add_argument("--output", help="write this run's results to a JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for boids in args.boids:
+        for walls in args.walls:
+            result = run_scenario(boids, walls, args.engine, args.steps, args.frames)
+            results.append(result)
+            print(f"{result['key']:<32} {result['ms_per_step']:9.2f} ms/step {result['ms_per_frame']:9.2f} ms/frame {result['steps_per_second']:9.2f} steps/s")
+
+    host = host_info()
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": host, "threshold": args.threshold, "results": results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+    stored_host, baseline = load_baseline(args.baseline)
+    mismatches = host_mismatches(host, stored_host) if baseline else []
+
+    if args.update_baseline:
+        # Scenarios not in this run, such as other engines, keep their stored results if they came from this machine
+        if mismatches:
+            print(f"Replacing a baseline from another machine ({', '.join(mismatches)})", file=sys.stderr)
+            baseline = {}
+
+        baseline.update({result["key"]: result for result in results})
+        stored = dict(report, results=sorted(baseline.values(), key=lambda result: (result["engine"], result["boids"], result["walls"])))
+
+        with open(args.baseline, 'w') as file:
+            json.dump(stored, file, indent=4)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if mismatches and not args.ignore_host:
+        print(f"Skipping the baseline comparison, it was recorded on another machine ({', '.join(mismatches)}). Pass --ignore-host to compare anyway.", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+
+    for result in regressions:
+        print(f"Regression {result['key']}: {result['change'] * 100:.1f}% steps/s")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,28 @@
+import os
+
+# The pygame banner goes to stdout, where it would break the headless JSON results
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
 import pygame as pyg
 import pygame_gui as pygui
+import numpy as np
 import math
 import abc
-import os
+import sys
 import datetime
+import argparse
+import time
+import heapq
+import collections
+import contextlib
+import cProfile
+import pstats
+import io
 import json
+import multiprocessing
+import threading
+import queue
+from multiprocessing import shared_memory
 from enum import Enum
 
 class Config:
@@ -18,14 +36,34 @@ class Config:
     SCREEN_COLOUR = (0, 0, 0)
     FPS = 60
 
+    # Fixed timestep, simulation steps per simulated second whatever the frame rate
+    SIM_STEP_RATE = 60
+    MAX_STEPS_PER_FRAME = 64
+    STEP_TIME_BUDGET = 1 / 60 # Seconds of stepping per frame before the backlog is dropped
+    FAST_FORWARD_SPEEDS = [1, 2, 4, 8, 16, 0] # 0 runs uncapped
+    UNCAPPED_RENDER_INTERVAL = 32
+
+    # Step the simulation on a worker thread, the render loop draws the latest published snapshot
+    SIM_THREAD = True
+
+    # Simulation engine, "object" steps each Boid in turn, "numpy" steps the whole flock as arrays
+    # and "parallel" splits the array step across worker processes
+    ENGINE = "object"
+    VECTOR_CHUNK_SIZE = 4096
+    PARALLEL_WORKERS = None # None uses every CPU core
+    PARALLEL_MIN_BOIDS = 2000
+    PARALLEL_POLL_INTERVAL = 1 # Seconds between checks that the workers are still alive while waiting on them
+
     # Boid constants
     NUMBER_OF_BOIDS = 150
     BOID_SIZE = 3
+    BOID_SPRITE_ANGLES = 64
     ASSEMBLY_SIZE = 20
     EXIT_SIZE = 10
     DESTINATION_SIZE = 5
     BOUNDARY_THICKNESS = 3
     BOUNDARY_RADIUS = 5
+    BOUNDARY_INDEX_CELL_SIZE = 40
     BOID_COLOUR = (255, 255, 255)
     BOUNDARY_COLOUR = (255, 255, 255)
     ASSEMBLY_COLOUR = (239, 71, 111)
@@ -33,6 +71,20 @@ class Config:
     DESTINATION_COLOUR = (255, 209, 102)
     EDGE_COLOUR = (220, 220, 220)
 
+    # Level of detail, above the threshold boids are written straight into the frame as "points" or a "density" splat
+    LOD_BOID_THRESHOLD = 5000
+    LOD_MODE = "points"
+    LOD_DENSITY_STEP = 64
+
+    # Wall avoidance, "geometric" tests nearby wall quads and "distance_field" samples a precomputed raster
+    WALL_AVOIDANCE = "geometric"
+    DISTANCE_FIELD_RESOLUTION = 2
+    DISTANCE_FIELD_RANGE = 20
+
+    # Navigation, "graph" follows per-boid Dijkstra paths and "flow_field" samples a shared direction grid
+    NAVIGATION = "graph"
+    FLOW_FIELD_CELL_SIZE = 10
+
     # Movement values
     MAX_SPEED = 0.7
     MAX_ACC_REQUEST = 0.15
@@ -49,6 +101,7 @@ class Config:
     ARRIVAL_SLOWING_RADIUS = 100
     ARRIVED_RADIUS = 5
     GRAPH_EDGE_RADIUS = 150
+    NODE_INDEX_CELL_SIZE = 100
 
     # Menu layout
     MOUSE_BOUNDARY_MARGIN = 90
@@ -73,10 +126,37 @@ class Config:
     IMAGE_MARGIN_Y = 100
     ERASE_RADIUS = 12
 
+    # Headless runs
+    HEADLESS_MAX_STEPS = 100000
+
+    # Per phase step timings, off by default and free when off
+    STEP_TIMING = False
+    STEP_TIMING_WINDOW = 300 # Steps kept for the rolling statistics
+
+    # Profile capture, started with the key below in the simulation or --profile when headless
+    PROFILES_FOLDER = "profiles"
+    PROFILE_TOGGLE_KEY = pyg.K_p
+    PROFILE_FRAMES = 300
+    PROFILE_TOP_FUNCTIONS = 30
+
     # Playback controls layout
     PLAYBACK_Y = SCREEN_HEIGHT - 80
     PLAYBACK_X = SCREEN_WIDTH - 90
     PLAYBACK_SPACING = 60
+    PLAYBACK_LABEL_COLOUR = (255, 255, 255)
+
+    # Performance HUD, toggled with the key below while the simulation is showing
+    HUD_TOGGLE_KEY = pyg.K_h
+    HUD_MARGIN = 10 # Anchored to the bottom left, clear of the sliders and playback buttons
+    HUD_HISTORY = 240 # Frames kept for the histogram
+    HUD_HISTOGRAM_BINS = 25
+    HUD_HISTOGRAM_MAX_MS = 50
+    HUD_HISTOGRAM_SIZE = (200, 60)
+    HUD_PAIR_INTERVAL = 30 # Frames between neighbour pair recounts
+    HUD_COLOUR = (255, 255, 255)
+    HUD_BAR_COLOUR = (6, 214, 160)
+    HUD_SLOW_COLOUR = (239, 71, 111)
+    HUD_BACKGROUND = (0, 0, 0, 160)
 
 class GameState(Enum):
     MENU = "menu"
@@ -87,16 +167,27 @@ class PlaybackControls:
     def __init__(self, sim):
         self.__sim = sim
         self.__is_running = True
+        self.__speed_index = 0
+        self.__font = pyg.font.Font(None, 24)
 
         self.__control_buttons = {}
 
         self.__control_buttons["play"] = Button(Config.PLAYBACK_X, Config.PLAYBACK_Y, f"{Config.IMAGES_FOLDER}/play_button.png", 0.3)
         self.__control_buttons["pause"] = Button(Config.PLAYBACK_X, Config.PLAYBACK_Y, f"{Config.IMAGES_FOLDER}/pause_button.png", 0.3)
         self.__control_buttons["step"] = Button(Config.PLAYBACK_X - Config.PLAYBACK_SPACING, Config.PLAYBACK_Y, f"{Config.IMAGES_FOLDER}/step_button.png", 0.3)
+        self.__control_buttons["fast_forward"] = Button(Config.PLAYBACK_X - (2 * Config.PLAYBACK_SPACING), Config.PLAYBACK_Y, f"{Config.IMAGES_FOLDER}/fast_forward_button.png", 0.3)
 
     def draw_buttons(self, screen):
         gui_active = self.__sim.get_gui().get_active()
 
+        if self.__control_buttons["fast_forward"].draw(screen, gui_active):
+            self.fast_forward()
+
+        # Current speed above the fast forward button
+        speed = self.get_speed()
+        label = self.__font.render("max" if speed == 0 else f"x{speed}", True, Config.PLAYBACK_LABEL_COLOUR)
+        screen.blit(label, (Config.PLAYBACK_X - (2 * Config.PLAYBACK_SPACING), Config.PLAYBACK_Y - 20))
+
         if self.__is_running:
             if self.__control_buttons["pause"].draw(screen, gui_active):
                 self.pause()
@@ -111,12 +202,119 @@ class PlaybackControls:
 
     def play(self):
         self.__is_running = True
+        self.__sim.send_sim_command("play")
 
     def pause(self):
         self.__is_running = False
+        self.__sim.send_sim_command("pause")
 
     def step(self):
-        self.__sim.step()
+        # Stepped by the simulation worker when one is running
+        if not self.__sim.send_sim_command("step"):
+            self.__sim.step()
+
+    def fast_forward(self):
+        self.__speed_index = (self.__speed_index + 1) % len(Config.FAST_FORWARD_SPEEDS)
+        self.__sim.send_sim_command("speed", self.get_speed())
+
+    def get_speed(self):
+        return Config.FAST_FORWARD_SPEEDS[self.__speed_index]
+
+class PerformanceHud:
+    def __init__(self):
+        self.__visible = False
+        self.__font = pyg.font.Font(None, 20)
+
+        self.__frame_times = collections.deque(maxlen=Config.HUD_HISTORY)
+        self.__render_times = collections.deque(maxlen=Config.HUD_HISTORY)
+        self.__step_times = collections.deque(maxlen=Config.HUD_HISTORY)
+
+        self.__pair_count = 0
+        self.__frames_since_pairs = Config.HUD_PAIR_INTERVAL
+
+    def toggle(self):
+        self.__visible = not self.__visible
+
+    def is_visible(self):
+        return self.__visible
+
+    def record_frame(self, frame_time, render_time, step_time=None):
+        self.__frame_times.append(frame_time * 1000)
+        self.__render_times.append(render_time * 1000)
+        if step_time is not None:
+            self.__step_times.append(step_time * 1000)
+
+    def pairs_due(self):
+        return self.__frames_since_pairs >= Config.HUD_PAIR_INTERVAL
+
+    def update_pairs(self, positions, radius):
+        # Counted from the same cell list the array engine uses, only every few frames as it costs a neighbour pass
+        self.__frames_since_pairs = 0
+
+        positions = np.asarray(positions)
+        if len(positions) < 2:
+            self.__pair_count = 0
+            return
+
+        # Chunked like the engine's gather so a large crowd never holds every pair at once
+        neighbours = np.zeros(len(positions), dtype=np.int64)
+        for chunk_start in range(0, len(positions), Config.VECTOR_CHUNK_SIZE):
+            rows = np.arange(chunk_start, min(chunk_start + Config.VECTOR_CHUNK_SIZE, len(positions)))
+            owners, candidates, distance_squared = VectorisedFlock.neighbour_pairs(positions, rows, radius)
+            neighbours[rows] = np.bincount(owners, minlength=len(rows))
+
+        # Each pair is seen from both ends
+        self.__pair_count = int(neighbours.sum()) // 2
+
+    def __average(self, values):
+        return sum(values) / len(values) if values else 0
+
+    def __draw_histogram(self, screen, x, y):
+        width, height = Config.HUD_HISTOGRAM_SIZE
+        counts, edges = np.histogram(np.minimum(self.__frame_times, Config.HUD_HISTOGRAM_MAX_MS), bins=Config.HUD_HISTOGRAM_BINS, range=(0, Config.HUD_HISTOGRAM_MAX_MS))
+
+        peak = max(counts.max(), 1)
+        bar_width = width / Config.HUD_HISTOGRAM_BINS
+        budget = 1000 / Config.FPS
+
+        # Bars past the frame budget are highlighted, the last bin also holds everything slower than the range
+        for i, count in enumerate(counts.tolist()):
+            bar_height = int((count / peak) * height)
+            colour = Config.HUD_SLOW_COLOUR if edges[i] >= budget else Config.HUD_BAR_COLOUR
+            pyg.draw.rect(screen, colour, (x + int(i * bar_width), y + height - bar_height, max(int(bar_width) - 1, 1), bar_height))
+
+        pyg.draw.rect(screen, Config.HUD_COLOUR, (x, y, width, height), 1)
+        label = self.__font.render(f"0-{Config.HUD_HISTOGRAM_MAX_MS} ms", True, Config.HUD_COLOUR)
+        screen.blit(label, (x, y + height + 2))
+
+    def draw(self, screen, fps, boids):
+        self.__frames_since_pairs += 1
+
+        lines = [f"FPS: {fps:.1f}",
+                 f"Frame: {self.__average(self.__frame_times):.2f} ms (max {max(self.__frame_times, default=0):.2f})",
+                 f"Step: {self.__average(self.__step_times):.2f} ms",
+                 f"Render: {self.__average(self.__render_times):.2f} ms",
+                 f"Boids: {boids}",
+                 f"Neighbour pairs: {self.__pair_count}"]
+
+        labels = [self.__font.render(line, True, Config.HUD_COLOUR) for line in lines]
+        line_height = self.__font.get_linesize()
+        width = max([Config.HUD_HISTOGRAM_SIZE[0]] + [label.get_width() for label in labels]) + 20
+        height = (len(lines) * line_height) + Config.HUD_HISTOGRAM_SIZE[1] + line_height + 25
+
+        x = Config.HUD_MARGIN
+        y = screen.get_height() - height - Config.HUD_MARGIN
+
+        panel = pyg.Surface((width, height), pyg.SRCALPHA)
+        panel.fill(Config.HUD_BACKGROUND)
+        screen.blit(panel, (x, y))
+
+        y += 5
+        for label in labels:
+            screen.blit(label, (x + 10, y))
+            y += line_height
+
+        self.__draw_histogram(screen, x + 10, y + 5)
 
 class GUI:
     def __init__(self, sim):
@@ -218,26 +416,45 @@ class GUI:
                 self.__sliders[slider_key].set_relative_position((x, y))
     
 class Sim:
-    def __init__(self):
-        pyg.init()
+    def __init__(self, headless=False):
+        self.__headless = headless
 
         # Map state controls
         self.__current_game_state = GameState.MENU
         self.__running = False
         self.__map_loaded = False
 
-        # Window / sim variables
-        self.__screen = pyg.display.set_mode((Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT))
+        # Window / sim variables, headless runs draw to an offscreen surface and have no GUI
+        if headless:
+            self.__screen = pyg.Surface((Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT))
+        else:
+            pyg.init()
+            self.__screen = pyg.display.set_mode((Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT))
         self.__window = self.__screen.get_rect()
         self.__clock = pyg.time.Clock()
-        self.__gui = GUI(self)
+        self.__step_scheduler = StepScheduler()
+        self.__boid_sprites = BoidSprites()
+        self.__background = None
+        self.__gui = None if headless else GUI(self)
         self.__tracing_img = None
 
         # Composite objects
-        self.__menu = Menu(self)
-        self.__map_builder = MapBuilder(self)
-        self.__playback_controls = PlaybackControls(self)
+        self.__menu = None if headless else Menu(self)
+        self.__map_builder = None if headless else MapBuilder(self)
+        self.__playback_controls = None if headless else PlaybackControls(self)
         self.__graph = Graph()
+        self.__boid_grid = SpatialHash(Config.DEFAULT_VISUAL_RANGE)
+        self.__boundary_index = BoundaryIndex(Config.BOUNDARY_INDEX_CELL_SIZE)
+        self.__distance_field = None
+        self.__wall_avoidance = Config.WALL_AVOIDANCE
+        self.__flow_field = None
+        self.__navigation = Config.NAVIGATION
+        self.__vector_flock = VectorisedFlock(self)
+        self.__engine = Config.ENGINE
+        self.__sim_worker = None
+        self.__step_timer = StepTimer() if Config.STEP_TIMING else None
+        self.__hud = None if headless else PerformanceHud()
+        self.__profile_capture = None
 
         # Instantiate object containers
         self.__assembly_point = None
@@ -254,8 +471,108 @@ class Sim:
                                "avoidance": Config.DEFAULT_AVOIDANCE_FACTOR}
 
         # Title and icon
-        pyg.display.set_caption("Boids Simulation")
-        pyg.display.set_icon(pyg.image.load(f"{Config.IMAGES_FOLDER}/window_icon.png"))
+        if not headless:
+            pyg.display.set_caption("Boids Simulation")
+            pyg.display.set_icon(pyg.image.load(f"{Config.IMAGES_FOLDER}/window_icon.png"))
+
+    def load_headless_map(self, path):
+        success, data, error = JSONManager.load_map(path)
+        if not success:
+            return (False, error)
+
+        boundaries = [Boundary((pyg.math.Vector2(start), pyg.math.Vector2(end))) for start, end in data["boundaries"]]
+        boids = []
+        for pos in data["boids"]:
+            boid = Boid(self)
+            boid.set_pos(pyg.math.Vector2(pos))
+            boids.append(boid)
+
+        self.import_objects_to_sim(boundaries, AssemblyPoint(pyg.math.Vector2(data["assembly_point"])), boids, None)
+        if data["graph"]:
+            self.import_graph(data["graph"])
+
+        self.enable_pathfinding()
+        self.set_map_loaded()
+
+        return (True, None)
+
+    def run_headless(self, path, max_steps=None, profile_steps=None):
+        # Step a saved map as fast as possible until every boid that can arrive has, or max_steps is reached
+        success, error = self.load_headless_map(path)
+        if not success:
+            return {"map": path, "error": error}
+
+        limit = max_steps if max_steps is not None else Config.HEADLESS_MAX_STEPS
+        steps = 0
+        arrived, unreachable, total = self.get_arrival_counts()
+
+        # The first profile_steps steps are captured, step timings include the profiler overhead
+        capture = ProfileCapture(profile_steps, "headless") if profile_steps else None
+        profile_files = None
+        if capture is not None and not capture.start():
+            capture = None
+
+        start_time = time.perf_counter()
+
+        while steps < limit:
+            # A fixed step count runs to the end, otherwise stop once everyone with a way out has arrived
+            if max_steps is None and arrived + unreachable == total:
+                break
+
+            self.step()
+            steps += 1
+
+            if capture is not None and capture.tick():
+                profile_files = capture.get_files()
+                capture = None
+
+            if max_steps is None:
+                arrived, unreachable, total = self.get_arrival_counts()
+
+        elapsed = time.perf_counter() - start_time
+        arrived, unreachable, total = self.get_arrival_counts()
+
+        # Runs that finish before the capture does still write what was profiled
+        if capture is not None:
+            capture.stop()
+            profile_files = capture.get_files()
+
+        # The worker pool stays up for further runs until close
+        self.__sync_boids()
+
+        results = {"map": path, "engine": self.__engine, "steps": steps, "boids": total, "arrived": arrived, "unreachable": unreachable,
+                "completed": arrived == total, "elapsed": elapsed, "steps_per_second": steps / elapsed if elapsed > 0 else 0,
+                "positions": [(boid.get_pos().x, boid.get_pos().y) for boid in self.__boid_container]}
+
+        if profile_files is not None:
+            results["profile"] = profile_files
+
+        return results
+
+    def get_arrival_counts(self):
+        # Boids following a graph path have arrived once it completes, flow field boids once inside the assembly point
+        # Boids with no path, or stuck where the flow field cannot reach, are unreachable rather than arrived
+        flow_field = self.__flow_field if self.__navigation == "flow_field" else None
+
+        if self.__uses_vector_flock():
+            return self.__vector_flock.get_arrival_counts(flow_field)
+
+        if flow_field is not None:
+            positions = np.array([(boid.get_pos().x, boid.get_pos().y) for boid in self.__boid_container], dtype=np.float64).reshape(-1, 2)
+            target = flow_field.get_target()
+            arrived = ((positions - (target.x, target.y)) ** 2).sum(axis=1) < Config.ASSEMBLY_SIZE ** 2
+            unreachable = ~arrived & ~flow_field.is_reachable(positions)
+            return int(arrived.sum()), int(unreachable.sum()), len(self.__boid_container)
+
+        arrived = 0
+        unreachable = 0
+        for boid in self.__boid_container:
+            if boid.get_pathfinding() is None:
+                unreachable += 1
+            elif boid.get_pathfinding().get_completed():
+                arrived += 1
+
+        return arrived, unreachable, len(self.__boid_container)
 
     def import_graph(self, graph):
         self.__graph.load_json(graph)
@@ -264,6 +581,7 @@ class Sim:
         self.reset_simulation()
         self.set_tracing_img(img)
         self.create_boundary_container(boundaries)
+        self.__boundary_index.build(self.__boundary_container)
         self.create_boid_container(boids)
         self.create_assembly_point(assembly)
 
@@ -274,6 +592,7 @@ class Sim:
         self.create_assembly_point(assembly, True)
         if graph:
             self.__map_builder.get_builder_graph().load_json(graph)
+        self.__map_builder.rebuild_visibility_graph()
         self.__map_builder.handle_image(img_path)
 
     def reset_simulation(self):
@@ -281,12 +600,40 @@ class Sim:
         self.__boundary_container = []
         self.__assembly_point = None
         self.__graph.clear()
+        self.__boundary_index.clear()
+        self.__distance_field = None
+        self.__flow_field = None
+        self.__background = None
 
     def enable_pathfinding(self):
         graph = self.__graph
 
-        for boid in self.__boid_container:
-            boid.assign_path(graph)
+        if self.__navigation == "flow_field":
+            self.__build_flow_field()
+        else:
+            # Nearest exits for the whole flock in one batched query
+            positions = [(boid.get_pos().x, boid.get_pos().y) for boid in self.__boid_container]
+            exit_ids = graph.find_nearest_nodes(positions, 'exit')
+
+            for boid, exit_id in zip(self.__boid_container, exit_ids.tolist()):
+                boid.assign_path(graph, exit_id if exit_id >= 0 else None)
+
+        if self.__uses_vector_flock():
+            self.__vector_flock.load(self.__boid_container)
+
+    def __build_flow_field(self):
+        # Head for the graph's assembly node, or the placed assembly point if the graph has none
+        assembly_nodes = self.__graph.get_nodes_by_type('assembly')
+        if assembly_nodes:
+            target = assembly_nodes[0].get_pos()
+        elif self.__assembly_point is not None:
+            target = self.__assembly_point.get_pos()
+        else:
+            self.__flow_field = None
+            return
+
+        self.__flow_field = FlowField(self.__window.w, self.__window.h, Config.FLOW_FIELD_CELL_SIZE)
+        self.__flow_field.build(self.__boundary_container, target)
 
     def mouse_in_boundary(self): 
         # Check mouse position does not exceed screen boundaries and does not fall in forbidden GUI zone
@@ -302,17 +649,20 @@ class Sim:
   
     def update_gui_values(self, gui):
         # Add values from sliders to simulation instance
-        self.__config_values["protected_range"] = gui.get_slider("protected_range").get_current_value()
-        self.__config_values["visual_range"] = gui.get_slider("visual_range").get_current_value()
-        self.__config_values["separation"] = gui.get_slider("separation").get_current_value()
-        self.__config_values["alignment"] = gui.get_slider("alignment").get_current_value()
-        self.__config_values["cohesion"] = gui.get_slider("cohesion").get_current_value()
-
-        gui.get_slider_label("protected_range").set_text(f"Protected Range: {self.__config_values['protected_range']}")
-        gui.get_slider_label("visual_range").set_text(f"Visual Range: {self.__config_values['visual_range']}")
-        gui.get_slider_label("separation").set_text(f"Separation: {self.__config_values['separation']:.2f}")
-        gui.get_slider_label("alignment").set_text(f"Alignment: {self.__config_values['alignment']:.2f}")
-        gui.get_slider_label("cohesion").set_text(f"Cohesion: {self.__config_values['cohesion']:.2f}")
+        values = {key: gui.get_slider(key).get_current_value() for key in ["protected_range", "visual_range", "separation", "alignment", "cohesion"]}
+
+        # The worker thread owns the config values while it runs so changes are queued to it
+        if self.__sim_worker is not None:
+            if any(self.__sim_worker.get_config_value(key) != value for key, value in values.items()):
+                self.__sim_worker.set_config_values(values)
+        else:
+            self.set_config_values(values)
+
+        gui.get_slider_label("protected_range").set_text(f"Protected Range: {values['protected_range']}")
+        gui.get_slider_label("visual_range").set_text(f"Visual Range: {values['visual_range']}")
+        gui.get_slider_label("separation").set_text(f"Separation: {values['separation']:.2f}")
+        gui.get_slider_label("alignment").set_text(f"Alignment: {values['alignment']:.2f}")
+        gui.get_slider_label("cohesion").set_text(f"Cohesion: {values['cohesion']:.2f}")
 
     def handle_events(self, gui):
             for event in pyg.event.get():
@@ -366,39 +716,168 @@ class Sim:
                             self.__map_builder.wall_end(pyg.mouse.get_pos(), True)
 
                     if self.__current_game_state == GameState.SIMULATION:
-                        pass
+                        if event.key == Config.HUD_TOGGLE_KEY:
+                            self.__hud.toggle()
+                        elif event.key == Config.PROFILE_TOGGLE_KEY:
+                            self.start_profile_capture()
                             
                 gui.process_gui_event(event)
 
+    def __rebuild_boid_grid(self):
+        # Cells are as wide as the largest query radius so each lookup only touches the surrounding 3x3 cells
+        cell_size = max(self.__config_values["visual_range"], self.__config_values["protected_range"])
+        self.__boid_grid.clear(cell_size)
+
+        for boid in self.__boid_container:
+            self.__boid_grid.insert(boid, boid.get_pos())
+
+    def __uses_vector_flock(self):
+        return self.__engine in ["numpy", "parallel"]
+
     def step(self):
+        # Timing is chosen once per step so the untimed path pays nothing for it
+        if self.__step_timer is not None:
+            self.__timed_step(self.__step_timer)
+            return
+
+        if self.__uses_vector_flock():
+            self.__vector_flock.step()
+            return
+
+        self.__rebuild_boid_grid()
+
+        # Every boid reads the front buffers, new state is only published once all of them have stepped
         for boid in self.__boid_container:
             boid.step()
 
-    def render(self):
-        # Wipe last screen
-        self.__screen.fill(Config.SCREEN_COLOUR)
+        for boid in self.__boid_container:
+            boid.swap_buffers()
+
+    def __timed_step(self, timer):
+        with timer.phase("step"):
+            if self.__uses_vector_flock():
+                self.__vector_flock.step()
+            else:
+                with timer.phase("grid"):
+                    self.__rebuild_boid_grid()
+
+                for boid in self.__boid_container:
+                    boid.timed_step(timer)
+
+                for boid in self.__boid_container:
+                    boid.swap_buffers()
+
+        timer.end_step()
+
+    def __build_background(self):
+        # Tracing image and walls don't change during a run so are drawn once
+        self.__background = pyg.Surface((Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT))
+        self.__background.fill(Config.SCREEN_COLOUR)
 
-        # Render image before other objects to have at back of screen
         if self.__tracing_img:
             img_rect = self.__tracing_img.get_rect(center=(Config.SCREEN_WIDTH // 2 + 60, Config.SCREEN_HEIGHT // 2))
-            self.__screen.blit(self.__tracing_img, img_rect)
-
-        for boid in self.__boid_container:
-            boid.draw(self.__screen)
+            self.__background.blit(self.__tracing_img, img_rect)
 
         for boundary in self.__boundary_container:
-            boundary.draw(self.__screen)
-            # boundary.draw_expanded(self.__screen)
-            
+            boundary.draw(self.__background)
+            # boundary.draw_expanded(self.__background)
+
+    def __boid_arrays(self):
+        if self.__uses_vector_flock():
+            return (self.__vector_flock.get_positions(), self.__vector_flock.get_velocities())
+
+        positions = np.array([(boid.get_pos().x, boid.get_pos().y) for boid in self.__boid_container], dtype=np.float64).reshape(-1, 2)
+        velocities = np.array([(boid.get_vel().x, boid.get_vel().y) for boid in self.__boid_container], dtype=np.float64).reshape(-1, 2)
+        return (positions, velocities)
+
+    def snapshot(self, step=0, step_time=None):
+        positions, velocities = self.__boid_arrays()
+        return SimSnapshot(positions, velocities, step, step_time)
+
+    def render(self, snapshot=None):
+        # Wipe last screen with the cached background
+        if self.__background is None:
+            self.__build_background()
+
+        self.__screen.blit(self.__background, (0, 0))
+
+        # Sprites are drawn straight from the arrays, the boid objects are only synced when something reads them
+        if snapshot is not None:
+            positions = snapshot.get_positions()
+            velocities = snapshot.get_velocities()
+        else:
+            positions, velocities = self.__boid_arrays()
+
+        if len(positions) > Config.LOD_BOID_THRESHOLD:
+            self.__boid_sprites.draw_pixels(self.__screen, positions, Config.LOD_MODE)
+        else:
+            self.__boid_sprites.draw(self.__screen, positions, velocities)
+
         if self.__assembly_point is not None:
             pass
             # self.__assembly_point.draw(self.__screen)
 
+    def __advance_simulation(self, time_delta):
+        return self.__step_scheduler.advance(time_delta, self.__playback_controls.get_speed(), self.run_steps)
+
+    def run_steps(self, count, budget=None):
+        # Steps slower than real time would make every frame longer than the last, so a batch stops once over budget
+        start = time.perf_counter()
+        for i in range(count):
+            self.step()
+
+            if budget is not None and time.perf_counter() - start > budget:
+                return i + 1
+
+        return count
+
+    def __start_sim_worker(self):
+        self.__sim_worker = SimulationWorker(self, self.__playback_controls.is_running(), self.__playback_controls.get_speed())
+        self.__sim_worker.start()
+
+    def __stop_sim_worker(self):
+        if self.__sim_worker is None:
+            return
+
+        self.__sim_worker.stop()
+        self.__sim_worker = None
+
+    def __sync_boids(self):
+        # Copy array state back onto the boid objects for code that reads them directly
+        if self.__uses_vector_flock():
+            self.__vector_flock.write_back()
+
+    def start_profile_capture(self, frames=None):
+        frames = frames if frames is not None else Config.PROFILE_FRAMES
+        if self.__profile_capture is not None:
+            return
+
+        # Only one profiler can run at a time, so with a simulation thread its steps are profiled instead of the frames
+        if self.send_sim_command("profile", frames):
+            return
+
+        capture = ProfileCapture(frames, "frames")
+        if capture.start():
+            self.__profile_capture = capture
+
+    def __stop_profile_capture(self):
+        if self.__profile_capture is not None:
+            self.__profile_capture.stop()
+            self.__profile_capture = None
+
+    def send_sim_command(self, command, value=None):
+        if self.__sim_worker is None:
+            return False
+
+        self.__sim_worker.send(command, value)
+        return True
+
     def run(self):
         self.__running = True
         while self.__running:
-            # Tick clock to limit FPS
-            time_delta = self.__clock.tick(Config.FPS) / 1000.0
+            # Tick clock to limit FPS, uncapped fast forward doesn't wait for the frame
+            uncapped = self.__current_game_state == GameState.SIMULATION and self.__playback_controls.get_speed() == 0 and not Config.SIM_THREAD
+            time_delta = self.__clock.tick(0 if uncapped else Config.FPS) / 1000.0
             # print(self.__clock.get_fps())
 
             # Check for any pygame events
@@ -409,11 +888,36 @@ class Sim:
 
             # Advance one step of simulation and render
             if self.__current_game_state == GameState.SIMULATION:
-                if self.__playback_controls.is_running():
-                    self.step()
+                snapshot = None
+                step_time = None
+
+                if Config.SIM_THREAD:
+                    if self.__sim_worker is None:
+                        self.__start_sim_worker()
+
+                    snapshot = self.__sim_worker.get_snapshot()
+                    step_time = snapshot.get_step_time()
+                elif self.__playback_controls.is_running():
+                    step_start = time.perf_counter()
+                    steps = self.__advance_simulation(time_delta)
+                    if steps > 0:
+                        step_time = (time.perf_counter() - step_start) / steps
+                else:
+                    self.__step_scheduler.reset()
 
-                self.render()
+                render_start = time.perf_counter()
+                self.render(snapshot)
                 self.__playback_controls.draw_buttons(self.__screen)
+
+                if self.__hud.is_visible():
+                    self.__hud.record_frame(time_delta, time.perf_counter() - render_start, step_time)
+                    if self.__hud.pairs_due():
+                        positions = snapshot.get_positions() if snapshot is not None else self.__boid_arrays()[0]
+                        self.__hud.update_pairs(positions, self.__config_values["visual_range"])
+                    self.__hud.draw(self.__screen, self.__clock.get_fps(), len(self.__boid_container))
+
+                if self.__profile_capture is not None and self.__profile_capture.tick():
+                    self.__profile_capture = None
             
             # Update GUI values
             self.update_gui_values(self.__gui)
@@ -429,12 +933,65 @@ class Sim:
             # Swap buffers
             pyg.display.flip()
 
+        self.close()
+
+        # Step timings gathered over the session, --step-timing or Config.STEP_TIMING
+        if self.__step_timer is not None and self.__step_timer.get_steps() > 0:
+            print(self.__step_timer.format_stats(), file=sys.stderr)
+
+    def close(self):
+        # Shut down the simulation thread and any worker processes, a parallel run carries on single process
+        self.__stop_profile_capture()
+        self.__stop_sim_worker()
+        self.__vector_flock.set_worker_pool(None)
+
+        if self.__engine == "parallel":
+            self.__engine = "numpy"
+
     def get_config_value(self, type):
         return self.__config_values[type]
+
+    def set_config_values(self, values):
+        self.__config_values.update(values)
     
     def get_graph(self):
         return self.__graph
     
+    def get_boid_grid(self):
+        return self.__boid_grid
+
+    def get_boundary_index(self):
+        return self.__boundary_index
+
+    def get_wall_avoidance(self):
+        return self.__wall_avoidance
+
+    def get_navigation(self):
+        return self.__navigation
+
+    def get_flow_field(self):
+        return self.__flow_field
+
+    def get_distance_field(self):
+        # Built on first use, the walls do not change while the simulation runs
+        if self.__distance_field is None:
+            self.__distance_field = DistanceField(self.__window.w, self.__window.h, Config.DISTANCE_FIELD_RESOLUTION)
+            self.__distance_field.build(self.__boundary_container)
+
+        return self.__distance_field
+
+    def get_engine(self):
+        return self.__engine
+
+    def get_step_timer(self):
+        return self.__step_timer
+
+    def get_hud(self):
+        return self.__hud
+
+    def set_step_timing(self, enabled):
+        self.__step_timer = StepTimer() if enabled else None
+
     def get_map_builder(self):
         return self.__map_builder
 
@@ -487,8 +1044,14 @@ class Sim:
         else:
             for boundary in lst:
                 self.__boundary_container.append(boundary)
+            self.__background = None
 
     def set_game_state(self, state):
+        # Leaving the simulation hands the boids back to the main thread in step with the arrays
+        if state != "simulation":
+            self.__stop_sim_worker()
+            self.__sync_boids()
+
         if state == "menu":
             self.__current_game_state = GameState.MENU
             self.__gui.set_gui_layout("menu")
@@ -503,8 +1066,52 @@ class Sim:
         else:
             pass
 
+    def set_engine(self, engine):
+        if engine not in ["object", "numpy", "parallel"]:
+            print(f"Unknown engine: {engine}")
+            return
+
+        self.__sync_boids()
+
+        if engine == "parallel":
+            self.__vector_flock.set_worker_pool(FlockWorkerPool(Config.PARALLEL_WORKERS))
+        else:
+            self.__vector_flock.set_worker_pool(None)
+
+        self.__engine = engine
+
+        if self.__uses_vector_flock():
+            self.__vector_flock.load(self.__boid_container)
+
+    def set_wall_avoidance(self, mode):
+        if mode not in ["geometric", "distance_field"]:
+            print(f"Unknown wall avoidance mode: {mode}")
+            return
+
+        self.__wall_avoidance = mode
+
+        if self.__uses_vector_flock():
+            self.__vector_flock.write_back()
+            self.__vector_flock.load(self.__boid_container)
+
+    def set_navigation(self, mode):
+        if mode not in ["graph", "flow_field"]:
+            print(f"Unknown navigation mode: {mode}")
+            return
+
+        if mode == self.__navigation:
+            return
+
+        self.__navigation = mode
+
+        # Boids already placed re-plan from where they are, which also reloads the array engines with the new field or paths
+        if self.__boid_container:
+            self.__sync_boids()
+            self.enable_pathfinding()
+
     def set_tracing_img(self, img):
         self.__tracing_img = img 
+        self.__background = None
 
     def set_map_loaded(self):
         self.__map_loaded = True
@@ -512,6 +1119,181 @@ class Sim:
     def set_map_unloaded(self):
         self.__map_loaded = False
 
+class SimSnapshot:
+    def __init__(self, positions, velocities, step, step_time=None):
+        # Copies are frozen so the render thread never sees a half written step
+        self.__positions = np.array(positions, dtype=np.float64)
+        self.__velocities = np.array(velocities, dtype=np.float64)
+        self.__positions.flags.writeable = False
+        self.__velocities.flags.writeable = False
+        self.__step = step
+        self.__step_time = step_time
+
+    def get_positions(self):
+        return self.__positions
+
+    def get_velocities(self):
+        return self.__velocities
+
+    def get_step(self):
+        return self.__step
+
+    def get_step_time(self):
+        return self.__step_time
+
+class StepScheduler:
+    def __init__(self):
+        # Simulated time owed but not yet stepped
+        self.__accumulator = 0
+
+    def reset(self):
+        self.__accumulator = 0
+
+    def advance(self, elapsed, speed, run_steps):
+        # run_steps(count, budget) runs up to count steps and returns how many it managed
+        # Uncapped runs a fixed batch of steps between renders
+        if speed == 0:
+            return run_steps(Config.UNCAPPED_RENDER_INTERVAL, Config.STEP_TIME_BUDGET)
+
+        # Fixed timestep, steps owed for the elapsed time are run regardless of the frame rate
+        step_time = 1 / Config.SIM_STEP_RATE
+        self.__accumulator += elapsed * speed
+
+        due = min(int(self.__accumulator / step_time), Config.MAX_STEPS_PER_FRAME)
+        if due == 0:
+            return 0
+
+        steps = run_steps(due, Config.STEP_TIME_BUDGET)
+        self.__accumulator -= steps * step_time
+
+        # Drop any backlog we cannot catch up on rather than spiralling
+        if self.__accumulator >= step_time:
+            self.__accumulator = 0
+
+        return steps
+
+    def time_until_due(self, speed):
+        return max(0, (1 / Config.SIM_STEP_RATE - self.__accumulator) / speed)
+
+class SimulationWorker:
+    def __init__(self, sim, running=True, speed=1):
+        self.__sim = sim
+        self.__commands = queue.Queue()
+        self.__running = running
+        self.__speed = speed
+        self.__alive = False
+        self.__thread = None
+        self.__steps = 0
+        self.__config_values = {}
+        self.__profile_capture = None
+        self.__snapshot = sim.snapshot(0)
+
+    def start(self):
+        self.__alive = True
+        self.__thread = threading.Thread(target=self.__loop, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+
+        self.send("stop")
+        self.__thread.join()
+        self.__thread = None
+
+    def send(self, command, value=None):
+        self.__commands.put((command, value))
+
+    def __handle_command(self, command, value):
+        if command == "stop":
+            self.__alive = False
+        elif command == "play":
+            self.__running = True
+        elif command == "pause":
+            self.__running = False
+        elif command == "speed":
+            self.__speed = value
+        elif command == "config":
+            self.__sim.set_config_values(value)
+        elif command == "step":
+            self.__step(1)
+        elif command == "profile" and self.__profile_capture is None:
+            capture = ProfileCapture(value, "sim_thread")
+            if capture.start():
+                self.__profile_capture = capture
+
+    def __drain_commands(self, block=False, timeout=None):
+        try:
+            command, value = self.__commands.get(block, timeout)
+        except queue.Empty:
+            return
+
+        self.__handle_command(command, value)
+
+        while True:
+            try:
+                command, value = self.__commands.get_nowait()
+            except queue.Empty:
+                return
+            self.__handle_command(command, value)
+
+    def __step(self, count, budget=None):
+        # A batch over budget is published early so snapshots keep flowing
+        start = time.perf_counter()
+        count = self.__sim.run_steps(count, budget)
+        step_time = (time.perf_counter() - start) / count
+
+        # Publishing is a single reference swap so the render thread always sees a whole snapshot
+        self.__steps += count
+        self.__snapshot = self.__sim.snapshot(self.__steps, step_time)
+
+        if self.__profile_capture is not None:
+            for i in range(count):
+                if self.__profile_capture.tick():
+                    self.__profile_capture = None
+                    break
+
+        return count
+
+    def __loop(self):
+        scheduler = StepScheduler()
+        last = time.perf_counter()
+
+        while self.__alive:
+            if not self.__running:
+                # Sleep until the next command while paused
+                self.__drain_commands(True)
+                scheduler.reset()
+                last = time.perf_counter()
+                continue
+
+            self.__drain_commands()
+            if not self.__alive or not self.__running:
+                continue
+
+            # Same scheduler as the single threaded loop, measured on this thread's clock
+            now = time.perf_counter()
+            elapsed = now - last
+            last = now
+
+            if scheduler.advance(elapsed, self.__speed, self.__step) == 0:
+                # Wait for the next step to fall due, a command wakes the thread early
+                self.__drain_commands(True, scheduler.time_until_due(self.__speed))
+
+        if self.__profile_capture is not None:
+            self.__profile_capture.stop()
+            self.__profile_capture = None
+
+    def get_snapshot(self):
+        return self.__snapshot
+
+    def get_config_value(self, type):
+        return self.__config_values.get(type)
+
+    def set_config_values(self, values):
+        self.__config_values = dict(values)
+        self.send("config", self.__config_values)
+
 class Node:
     def __init__(self, pos, type, id):
         self.__pos = pyg.math.Vector2(pos)
@@ -542,19 +1324,42 @@ class Node:
     def add_neighbour(self, id, distance):
         self.__neighbours[id] = distance
 
+    def remove_neighbour(self, id):
+        self.__neighbours.pop(id, None)
+
 class Graph:
     def __init__(self):
         self.__nodes = {}
         self.__next_id = 0
         self.__adjacency_list = {}
 
+        # Nodes with an edge into each node, so removal doesn't scan every adjacency entry
+        self.__incoming = {}
+
+        # Bumped on every change so cached searches know when they are stale
+        self.__version = 0
+        self.__tree_cache = {}
+        self.__compact = None
+
+        # One spatial hash of nodes per node type for nearest node queries
+        self.__type_index = {}
+
+        # Path searches by name, each called as search(start, end)
+        self.__search_methods = {"dijkstra": self.__dijkstra_search, "astar": self.__astar_search}
+
     def add_node(self, pos, type):
         id = self.__next_id
         self.__next_id += 1
+        self.__version += 1
 
         node = Node(pos, type, id)
         self.__nodes[id] = node
         self.__adjacency_list[id] = {}
+        self.__incoming[id] = set()
+
+        if type not in self.__type_index:
+            self.__type_index[type] = SpatialHash(Config.NODE_INDEX_CELL_SIZE)
+        self.__type_index[type].insert(node, node.get_pos())
 
         return id
 
@@ -564,51 +1369,89 @@ class Graph:
         
         node_a = self.__nodes[id_a]
         node_b = self.__nodes[id_b]
+        self.__version += 1
 
         distance = node_a.get_pos().distance_to(node_b.get_pos())
 
         if not bi:
             self.__adjacency_list[id_a][id_b] = distance
             node_a.add_neighbour(id_b, distance)
+            self.__incoming[id_b].add(id_a)
         elif bi:
             self.__adjacency_list[id_a][id_b] = distance
             node_a.add_neighbour(id_b, distance)
+            self.__incoming[id_b].add(id_a)
             self.__adjacency_list[id_b][id_a] = distance
             node_b.add_neighbour(id_a, distance)
+            self.__incoming[id_a].add(id_b)
+
+    def remove_edge(self, id_a, id_b, bi = True):
+        if id_a not in self.__nodes or id_b not in self.__nodes:
+            return
+
+        self.__version += 1
+        pairs = [(id_a, id_b), (id_b, id_a)] if bi else [(id_a, id_b)]
+
+        for source_id, target_id in pairs:
+            self.__adjacency_list[source_id].pop(target_id, None)
+            self.__nodes[source_id].remove_neighbour(target_id)
+            self.__incoming[target_id].discard(source_id)
 
     def remove_node(self, id):
         if id in self.__nodes:
-            self.__nodes.pop(id)
-            self.__adjacency_list.pop(id)
+            node = self.__nodes.pop(id)
+            self.__type_index[node.get_type()].remove(node, node.get_pos())
+            self.__version += 1
 
-            for neighbours in self.__adjacency_list.values():
-                if id in neighbours:
-                    neighbours.pop(id)
+            for neighbour_id in self.__adjacency_list.pop(id):
+                self.__incoming[neighbour_id].discard(id)
 
-    def find_nearest_node(self, pos, type):
-        remaining_checks = list(self.__nodes.values())
+            for source_id in self.__incoming.pop(id):
+                self.__adjacency_list[source_id].pop(id, None)
+                self.__nodes[source_id].remove_neighbour(id)
 
+    def find_nearest_node(self, pos, type):
         if type:
-            temp = remaining_checks.copy()
-            for node in temp:
-                if node.get_type() == type:
-                    pass
-                else:
-                    remaining_checks.remove(node)
+            indexes = [self.__type_index[type]] if type in self.__type_index else []
+        else:
+            indexes = list(self.__type_index.values())
 
-        if not remaining_checks:
-            return None
-        
         smallest_dist = float('inf')
         nearest = None
-        for node in remaining_checks:
-            dist_squared = pos.distance_squared_to(node.get_pos())
+        for index in indexes:
+            node = index.nearest(pos)
+            if node is None:
+                continue
+
+            dist_squared = pyg.math.Vector2(pos).distance_squared_to(node.get_pos())
             if dist_squared < smallest_dist:
                 smallest_dist = dist_squared
                 nearest = node
 
+        if nearest is None:
+            return None
+
         return nearest.get_id()
 
+    def find_nearest_nodes(self, positions, type):
+        # Nearest node id for each row of an (n, 2) array, -1 where there is no node of that type
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        nearest = np.full(len(positions), -1, dtype=np.int64)
+        smallest_dist = np.full(len(positions), np.inf)
+
+        if type:
+            indexes = [self.__type_index[type]] if type in self.__type_index else []
+        else:
+            indexes = list(self.__type_index.values())
+
+        for index in indexes:
+            nodes, dist_squared = index.nearest_many(positions)
+            closer = np.nonzero(dist_squared < smallest_dist)[0]
+            smallest_dist[closer] = dist_squared[closer]
+            nearest[closer] = [nodes[row].get_id() for row in closer.tolist()]
+
+        return nearest
+
     def to_json(self):
         json_dict = {
             "nodes": [{"id": node.get_id(), "pos": (node.get_pos().x, node.get_pos().y), "type": node.get_type()} for node in self.__nodes.values()],
@@ -638,43 +1481,74 @@ class Graph:
                 self.add_edge(start, end, True)
                 edges_done.append(edge_key)
 
-    def dijkstra(self, start, end):        
-        distances = [float('inf')] * len(self.__nodes)
-        previous = [None] * len(self.__nodes)
-        distances[start] = 0
-        visited = [False] * len(self.__nodes)
-
-        for i in range(len(self.__nodes)):
-            min_distance = float('inf')
-            u = None
-            for j in range(len(self.__nodes)):
-                if not visited[j] and distances[j] < min_distance:
-                    min_distance = distances[j]
-                    u = j
-
-            if u is None:
-                break
+    def __search(self, start, end, heuristic):
+        # Best-first search over the compact graph, Dijkstra when the heuristic is always zero
+        compact = self.get_compact()
+        offsets, targets, weights = compact.get_adjacency()
+        start_index = compact.get_index(start)
+        end_index = compact.get_index(end)
+
+        distances = [float('inf')] * compact.get_size()
+        previous = [None] * compact.get_size()
+        visited = [False] * compact.get_size()
+        distances[start_index] = 0
+        queue = [(heuristic(start_index), start_index)]
+
+        while queue:
+            estimate, u = heapq.heappop(queue)
+            if visited[u]:
+                continue
 
             visited[u] = True
+            if u == end_index:
+                break
 
-            for v in range(len(self.__nodes)):
-                if v in self.__adjacency_list[u] and not visited[v]:
-                    new_dist = distances[u] + self.__adjacency_list[u][v]
-                    if new_dist < distances[v]:
-                        distances[v] = new_dist
-                        previous[v] = u
+            for edge in range(offsets[u], offsets[u + 1]):
+                v = targets[edge]
+                if visited[v]:
+                    continue
+
+                new_dist = distances[u] + weights[edge]
+                if new_dist < distances[v]:
+                    distances[v] = new_dist
+                    previous[v] = u
+                    heapq.heappush(queue, (new_dist + heuristic(v), v))
 
         path = []
-        current = end
+        current = end_index
         while current is not None:
             path.append(current)
             current = previous[current]
-            if current == start:
-                path.append(start)
+            if current == start_index:
+                path.append(start_index)
                 break
 
         path.reverse()
-        return path
+        return [compact.get_id(index) for index in path]
+
+    def __dijkstra_search(self, start, end):
+        return self.__search(start, end, lambda index: 0)
+
+    def __astar_search(self, start, end):
+        # Straight-line distance never overestimates since edge weights are node distances
+        positions = self.get_compact().get_positions()
+        end_x, end_y = positions[self.get_compact().get_index(end)]
+        return self.__search(start, end, lambda index: math.hypot(positions[index][0] - end_x, positions[index][1] - end_y))
+
+    def register_search(self, name, search):
+        self.__search_methods[name] = search
+
+    def find_path(self, start, end, method="dijkstra"):
+        if start not in self.__nodes or end not in self.__nodes:
+            return []
+
+        return self.__search_methods[method](start, end)
+
+    def dijkstra(self, start, end):
+        return self.find_path(start, end, "dijkstra")
+
+    def astar(self, start, end):
+        return self.find_path(start, end, "astar")
     
     def draw(self, screen):
         for node_id, neighbours in self.__adjacency_list.items():
@@ -686,10 +1560,61 @@ class Graph:
         for node in self.__nodes.values():
             node.draw(screen)
 
+    def shortest_path_tree(self, root):
+        # Parent of every node on its shortest path towards root, cached until the graph changes
+        cached = self.__tree_cache.get(root)
+        if cached is not None and cached[0] == self.__version:
+            return cached[1]
+
+        # Search outwards from root along reversed edges so directed edges are followed the right way
+        compact = self.get_compact()
+        offsets, sources, weights = compact.get_reverse_adjacency()
+        root_index = compact.get_index(root)
+
+        distances = [float('inf')] * compact.get_size()
+        parents = {root: None}
+        distances[root_index] = 0
+        queue = [(0, root_index)]
+
+        while queue:
+            current_distance, u = heapq.heappop(queue)
+            if current_distance > distances[u]:
+                continue
+
+            for edge in range(offsets[u], offsets[u + 1]):
+                v = sources[edge]
+                new_dist = current_distance + weights[edge]
+                if new_dist < distances[v]:
+                    distances[v] = new_dist
+                    parents[compact.get_id(v)] = compact.get_id(u)
+                    heapq.heappush(queue, (new_dist, v))
+
+        self.__tree_cache[root] = (self.__version, parents)
+        return parents
+
+    def path_to_root(self, start, root):
+        parents = self.shortest_path_tree(root)
+
+        # Unreachable starts head straight for the root, as dijkstra does
+        if start not in parents:
+            return [root]
+
+        path = [start]
+        current = start
+        while current != root:
+            current = parents[current]
+            path.append(current)
+
+        return path
+
     def clear(self):
         self.__nodes.clear()
         self.__adjacency_list.clear()
+        self.__incoming.clear()
+        self.__type_index = {}
         self.__next_id = 0
+        self.__version += 1
+        self.__tree_cache = {}
 
     def get_node(self, id):
         try:
@@ -711,7 +1636,74 @@ class Graph:
 
     def get_all_nodes(self):
         return self.__nodes
+
+    def get_version(self):
+        return self.__version
+
+    def get_compact(self):
+        # Rebuilt on demand whenever the graph has changed since the last build
+        if self.__compact is None or self.__compact.get_version() != self.__version:
+            self.__compact = CompactGraph(self.__nodes, self.__adjacency_list, self.__version)
+
+        return self.__compact
     
+class CompactGraph:
+    def __init__(self, nodes, adjacency_list, version):
+        self.__version = version
+
+        # Dense indices in id order, so removed ids leave no gaps
+        self.__ids = sorted(nodes)
+        self.__index_of = {id: index for index, id in enumerate(self.__ids)}
+        self.__positions = [(nodes[id].get_pos().x, nodes[id].get_pos().y) for id in self.__ids]
+
+        # CSR adjacency in plain lists, the edges of node i are targets[offsets[i]:offsets[i + 1]]
+        # The searches are Python loops reading one element at a time, which is faster from lists than arrays
+        offsets = [0]
+        targets = []
+        weights = []
+        incoming = [[] for id in self.__ids]
+        for index, id in enumerate(self.__ids):
+            for neighbour_id, distance in adjacency_list[id].items():
+                target = self.__index_of[neighbour_id]
+                targets.append(target)
+                weights.append(distance)
+                incoming[target].append((index, distance))
+            offsets.append(len(targets))
+
+        # The same edges grouped by target, for searches that walk edges backwards
+        reverse_offsets = [0]
+        reverse_sources = []
+        reverse_weights = []
+        for edges in incoming:
+            for source, distance in edges:
+                reverse_sources.append(source)
+                reverse_weights.append(distance)
+            reverse_offsets.append(len(reverse_sources))
+
+        self.__adjacency = (offsets, targets, weights)
+        self.__reverse_adjacency = (reverse_offsets, reverse_sources, reverse_weights)
+
+    def get_index(self, id):
+        return self.__index_of[id]
+
+    def get_id(self, index):
+        return self.__ids[index]
+
+    def get_size(self):
+        return len(self.__ids)
+
+    def get_version(self):
+        return self.__version
+
+    def get_adjacency(self):
+        return self.__adjacency
+
+    def get_reverse_adjacency(self):
+        return self.__reverse_adjacency
+
+    def get_positions(self):
+        return self.__positions
+
 class Pathfinding:
     def __init__(self, path, graph):
         self.__path = path
@@ -747,7 +1739,14 @@ class Pathfinding:
     def get_path(self):
         return self.__path
 
-class Menu:
+    def get_current_destination_index(self):
+        return self.__current_destination_index
+
+    def set_progress(self, index, completed):
+        self.__current_destination_index = index
+        self.__completed = completed
+
+class Menu:
     def __init__(self, sim):
         self.__sim = sim
         self.__buttons_dict = {}
@@ -901,6 +1900,12 @@ class MapBuilder:
         self.__builder_assembly = None
         self.__builder_boids = []
         self.__builder_graph = Graph()
+        self.__background = None
+        self.__background_version = None
+
+        # Indexes kept in step with every edit so visibility edges update incrementally
+        self.__node_grid = SpatialHash(Config.GRAPH_EDGE_RADIUS)
+        self.__wall_index = BoundaryIndex(Config.BOUNDARY_INDEX_CELL_SIZE)
 
         # Manage tool states
         self.__current_tool = None
@@ -1037,10 +2042,11 @@ class MapBuilder:
         if self.__builder_assembly:
             for id, node in list(self.__builder_graph.get_all_nodes().items()):
                 if node.get_type() == 'assembly':
-                    self.__builder_graph.remove_node(id)
+                    self.__remove_graph_node(id)
 
         self.__builder_assembly = AssemblyPoint(pos)
-        self.__builder_graph.add_node(pos, 'assembly')
+        self.__add_graph_node(pos, 'assembly')
+        self.__invalidate_background()
 
     def __use_boid_tool(self, pos):
         new_boid = Boid(self.__sim)
@@ -1048,51 +2054,127 @@ class MapBuilder:
         self.__builder_boids.append(new_boid)
 
     def __use_exit_tool(self, pos):
-        id = self.__builder_graph.add_node(pos, 'exit')
+        id = self.__add_graph_node(pos, 'exit')
 
     def __use_destination_tool(self, pos):
-        id = self.__builder_graph.add_node(pos, 'destination')
+        id = self.__add_graph_node(pos, 'destination')
 
-    def __create_edges(self):
-        """
-        clicked_id = self.__find_node_at_pos(pos, 20)
+    def __connect_node(self, id):
+        node = self.__builder_graph.get_node(id)
+        pos = node.get_pos()
+        adjacency_list = self.__builder_graph.get_adjacency_list()
+
+        candidates = []
+        for other in self.__node_grid.query(pos, Config.GRAPH_EDGE_RADIUS):
+            other_id = other.get_id()
+            if other_id == id or other_id in adjacency_list[id]:
+                continue
+
+            if pos.distance_squared_to(other.get_pos()) < Config.GRAPH_EDGE_RADIUS ** 2:
+                candidates.append(other)
 
-        if clicked_id is None:
-            self.__edge_start = None
+        if not candidates:
             return
-        
-        if self.__edge_start is None:
-            self.__edge_start = clicked_id
 
-        else:
-            if self.__edge_start != clicked_id:
-                self.__builder_graph.add_edge(self.__edge_start, clicked_id, True)
+        # Test every candidate edge against every wall near the node in one batch
+        radius = Config.GRAPH_EDGE_RADIUS
+        walls = self.__wall_index.query_rect((pos.x - radius, pos.y - radius), (pos.x + radius, pos.y + radius))
+        blocked = np.zeros(len(candidates), dtype=bool)
 
-            self.__edge_start = None
-        """
+        if walls:
+            wall_starts, wall_ends = Helper.segment_arrays(walls)
+            ends = [(other.get_pos().x, other.get_pos().y) for other in candidates]
+            hit, ua, points = Helper.batch_lines_intersect([(pos.x, pos.y)] * len(candidates), ends, wall_starts, wall_ends)
+            blocked = hit.any(axis=1)
+
+        for other, is_blocked in zip(candidates, blocked.tolist()):
+            if not is_blocked:
+                self.__builder_graph.add_edge(id, other.get_id(), True)
+
+    def __add_graph_node(self, pos, type):
+        id = self.__builder_graph.add_node(pos, type)
+        node = self.__builder_graph.get_node(id)
+
+        self.__node_grid.insert(node, node.get_pos())
+        self.__connect_node(id)
+
+        return id
+
+    def __remove_graph_node(self, id):
+        node = self.__builder_graph.get_node(id)
+        if node is None:
+            return
+
+        self.__node_grid.remove(node, node.get_pos())
+        self.__builder_graph.remove_node(id)
+
+    def __nodes_near_wall(self, boundary):
+        # Any edge crossing the wall has an endpoint within the edge radius of it
+        start, end = boundary.get_pos()
+        centre = (start + end) / 2
+        radius = start.distance_to(end) / 2 + Config.GRAPH_EDGE_RADIUS
+
+        return self.__node_grid.query(centre, radius)
+
+    def __add_wall(self, boundary):
+        self.__builder_boundaries.append(boundary)
+        self.__invalidate_background()
+        self.__wall_index.insert(boundary)
+
+        # Drop edges the new wall now blocks, testing all nearby edges in one batch
+        adjacency_list = self.__builder_graph.get_adjacency_list()
+        edges = []
+        for node in self.__nodes_near_wall(boundary):
+            for neighbour_id in adjacency_list.get(node.get_id(), {}):
+                edges.append((node, self.__builder_graph.get_node(neighbour_id)))
 
-        all_nodes = self.__builder_graph.get_all_nodes().items()
-        for id_a, node_a in all_nodes:
-            for id_b, node_b in all_nodes:
-                if node_a != node_b:
-                    if node_a.get_pos().distance_to(node_b.get_pos()) < Config.GRAPH_EDGE_RADIUS:
-                        if Helper.clear_path(node_a, node_b, self.__builder_boundaries):
-                            self.__builder_graph.add_edge(id_a, id_b, True)
+        if not edges:
+            return
+
+        wall_starts, wall_ends = Helper.segment_arrays([boundary])
+        starts = [(node.get_pos().x, node.get_pos().y) for node, neighbour in edges]
+        ends = [(neighbour.get_pos().x, neighbour.get_pos().y) for node, neighbour in edges]
+        hit, ua, points = Helper.batch_lines_intersect(starts, ends, wall_starts, wall_ends)
+
+        for (node, neighbour), is_blocked in zip(edges, hit[:, 0].tolist()):
+            if is_blocked:
+                self.__builder_graph.remove_edge(node.get_id(), neighbour.get_id(), True)
+
+    def __remove_wall(self, boundary):
+        self.__builder_boundaries.remove(boundary)
+        self.__invalidate_background()
+        self.__wall_index.remove(boundary)
+
+        # Pairs near the erased wall may be visible to each other now
+        for node in self.__nodes_near_wall(boundary):
+            self.__connect_node(node.get_id())
+
+    def rebuild_visibility_graph(self):
+        # Re-index everything after a bulk change such as loading a map, then add any missing edges
+        self.__wall_index.build(self.__builder_boundaries)
+        self.__node_grid.clear()
+
+        for node in self.__builder_graph.get_all_nodes().values():
+            self.__node_grid.insert(node, node.get_pos())
+
+        for id in list(self.__builder_graph.get_all_nodes()):
+            self.__connect_node(id)
 
     def __use_erase_tool(self, pos):
         node_id = self.__find_node_at_pos(pos, Config.ERASE_RADIUS)
         if node_id is not None:
-            self.__builder_graph.remove_node(node_id)
+            self.__remove_graph_node(node_id)
             return 
 
         for boundary in self.__builder_boundaries[:]:
             if self.__near_boundary(pos, boundary, Config.ERASE_RADIUS):
-                self.__builder_boundaries.remove(boundary)
+                self.__remove_wall(boundary)
                 return
         
         if self.__builder_assembly:
             if pyg.math.Vector2(pos).distance_squared_to(self.__builder_assembly.get_pos()) < (Config.ERASE_RADIUS ** 2):
                 self.__builder_assembly = None
+                self.__invalidate_background()
                 return
             
         for boid in self.__builder_boids[:]:
@@ -1103,7 +2185,7 @@ class MapBuilder:
     def __find_node_at_pos(self, pos, radius):
         pos_vector = pyg.math.Vector2(pos)
 
-        for node in self.__builder_graph.get_all_nodes().values():
+        for node in self.__node_grid.query(pos_vector, radius):
             if node.get_pos().distance_squared_to(pos_vector) < radius ** 2:
                 return node.get_id()
             
@@ -1128,8 +2210,11 @@ class MapBuilder:
         self.__builder_assembly = None
         self.__builder_boids = []
         self.__builder_graph.clear()
+        self.__node_grid.clear()
+        self.__wall_index.clear()
         self.__tracing_img = None
         self.__tracing_img_path = None
+        self.__invalidate_background()
         self.__current_tool = None
         self.__drawing_wall = False
         self.__wall_start = None
@@ -1163,7 +2248,6 @@ class MapBuilder:
                 print("Must place at least one boid")
                 return
             
-            self.__create_edges()
             self.__sim.import_objects_to_sim(self.__builder_boundaries, self.__builder_assembly, self.__builder_boids, self.__tracing_img)
             self.__import_graph_to_sim()
 
@@ -1204,6 +2288,7 @@ class MapBuilder:
                 # Filter applied to image
                 filtered = self.__apply_filter(scaled)
                 self.__tracing_img = filtered
+                self.__invalidate_background()
 
             except Exception as e:
                 print(f"An image error occurred: {e}")
@@ -1235,35 +2320,47 @@ class MapBuilder:
 
                 if self.__wall_start.distance_squared_to(wall_end) > 5 ** 2: # Squared function for efficiency
                     new_boundary = Boundary((self.__wall_start, wall_end))
-                    self.__builder_boundaries.append(new_boundary)
+                    self.__add_wall(new_boundary)
                 else:
                     print("Wall too short")
 
             self.__drawing_wall = False
             self.__wall_start = None
 
-    def render_builder(self, screen):
-        screen.fill(Config.SCREEN_COLOUR)
+    def __invalidate_background(self):
+        self.__background = None
 
-        gui_active = self.__sim.get_gui().get_active()
+    def __build_background(self):
+        # Tracing image, walls and graph are only redrawn after the map is edited
+        self.__background = pyg.Surface((Config.SCREEN_WIDTH, Config.SCREEN_HEIGHT))
+        self.__background.fill(Config.SCREEN_COLOUR)
+        self.__background_version = self.__builder_graph.get_version()
 
-        # Render image to trace
         if self.__tracing_img:
             img_rect = self.__tracing_img.get_rect(center=(Config.SCREEN_WIDTH // 2 + 60, Config.SCREEN_HEIGHT // 2))
-            screen.blit(self.__tracing_img, img_rect)
+            self.__background.blit(self.__tracing_img, img_rect)
 
         for boundary in self.__builder_boundaries:
-            boundary.draw(screen)
-            # boundary.draw_expanded(screen)
+            boundary.draw(self.__background)
+            # boundary.draw_expanded(self.__background)
 
         if self.__builder_assembly:
-            self.__builder_assembly.draw(screen)
+            self.__builder_assembly.draw(self.__background)
+
+        self.__builder_graph.draw(self.__background)
+
+    def render_builder(self, screen):
+        # Graph edits bump its version so they invalidate the cache too
+        if self.__background is None or self.__background_version != self.__builder_graph.get_version():
+            self.__build_background()
+
+        screen.blit(self.__background, (0, 0))
+
+        gui_active = self.__sim.get_gui().get_active()
 
         for boid in self.__builder_boids:
             boid.draw(screen)
 
-        self.__builder_graph.draw(screen)
-
         if self.__edge_start is not None:
             node = self.__builder_graph.get_node(self.__edge_start)
             if node:
@@ -1296,13 +2393,17 @@ class MapBuilder:
     
     def set_tracing_image(self, img):
         self.__tracing_img = img
+        self.__invalidate_background()
 
     def set_boundaries(self, lst):
         self.__builder_boundaries = lst
+        self.__invalidate_background()
+        self.rebuild_visibility_graph()
 
     def set_assembly(self, point):
         self.__builder_assembly = point
-        self.__builder_graph.add_node(point.get_pos(), 'assembly')
+        self.__invalidate_background()
+        self.__add_graph_node(point.get_pos(), 'assembly')
 
     def set_boids(self, lst):
         self.__builder_boids = lst
@@ -1420,9 +2521,13 @@ class BoidObject(abc.ABC):
         self._pos = pyg.math.Vector2(pos)
         self._max_speed = 1
 
+        # Back buffer written during a step, neighbours keep reading _pos and _vel until the swap
+        self._next_pos = pyg.math.Vector2(pos)
+        self._next_vel = pyg.math.Vector2(0, 0)
+
     @abc.abstractmethod
     def step(self):
-        self._vel += self._acc
+        self._next_vel = self._vel + self._acc
         # self._pos += self._vel
 
         self._acc = pyg.math.Vector2(0, 0)
@@ -1446,9 +2551,13 @@ class BoidObject(abc.ABC):
 
         # Bounce logic
         if pos.x >= window.w or pos.x <= 0:
-            self._vel[0] = -self._vel[0]
+            self._next_vel[0] = -self._next_vel[0]
         if pos.y >= window.h or pos.y <= 0:
-            self._vel[1] = -self._vel[1]
+            self._next_vel[1] = -self._next_vel[1]
+
+    def swap_buffers(self):
+        self._pos, self._next_pos = self._next_pos, self._pos
+        self._vel, self._next_vel = self._next_vel, self._vel
 
         
 class Boid(BoidObject):
@@ -1463,10 +2572,10 @@ class Boid(BoidObject):
     
     def __move(self):
         # Ensure velocity doesn't exceed max velocity
-        if self._vel.length_squared() > (Config.MAX_SPEED ** 2):
-            self._vel.scale_to_length(Config.MAX_SPEED)
+        if self._next_vel.length_squared() > (Config.MAX_SPEED ** 2):
+            self._next_vel.scale_to_length(Config.MAX_SPEED)
 
-        self.set_pos(self.get_pos() + self._vel)
+        self._next_pos = self.get_pos() + self._next_vel
     
     def __seeking_destination(self, destination):
         acc_request = pyg.math.Vector2(0, 0)
@@ -1503,7 +2612,26 @@ class Boid(BoidObject):
 
         return acc_request
         
+    def __seeking_flow_field(self, flow_field):
+        acc_request = pyg.math.Vector2(0, 0)
+
+        if self.get_pos().distance_squared_to(flow_field.get_target()) < Config.ARRIVED_RADIUS ** 2:
+            return acc_request
+
+        direction = flow_field.sample(self.get_pos())
+        if direction.length_squared() == 0:
+            return acc_request
+
+        # Steer towards the field direction at maximum speed
+        acc_request = direction * self._max_speed
+        acc_request -= self._vel
+
+        return acc_request
+
     def __avoid_boundary(self):
+        if self._sim.get_wall_avoidance() == "distance_field":
+            return self.__avoid_boundary_field()
+
         acc_request = pyg.math.Vector2(0, 0)
         nearby_boundaries = self.__boundaries_in_radius()
 
@@ -1521,7 +2649,7 @@ class Boid(BoidObject):
                     reverse_vector.normalize_ip()
                     acc_request += reverse_vector * (self._sim.get_config_value("boundary_range") * 5)
 
-                except ZeroDivisionError:
+                except (ZeroDivisionError, ValueError):
                     acc_request += boundary.get_perpendicular_vector() * self._sim.get_config_value("boundary_range")
 
                 return self.__limit_force(acc_request, nearby_boundaries)
@@ -1540,30 +2668,43 @@ class Boid(BoidObject):
             
                 return self.__limit_force(acc_request, nearby_boundaries)
 
-    def __separation(self):
+    def __avoid_boundary_field(self):
+        acc_request = pyg.math.Vector2(0, 0)
+        distance, gradient, nearest_boundary = self._sim.get_distance_field().sample(self.get_pos())
+
+        # Negative distances are inside a wall's radius, the gradient points back out
+        if distance >= 0 or nearest_boundary is None:
+            return acc_request
+
+        if gradient.length_squared() > 0:
+            acc_request += gradient.normalize() * self._sim.get_config_value("boundary_range")
+        else:
+            acc_request += nearest_boundary.get_perpendicular_vector() * self._sim.get_config_value("boundary_range")
+
+        return self.__limit_force(acc_request, [nearest_boundary])
+
+    def __separation(self, neighbouring_boids):
         acc_request = pyg.math.Vector2(0, 0)
-        neighbouring_boids = self.__boids_in_radius(self._sim.get_config_value("protected_range"))
 
         if len(neighbouring_boids) == 0:
             return acc_request
 
-        for neighbour in neighbouring_boids:
+        for neighbour, distance_squared in neighbouring_boids:
             try:
                 dist_delta = self.get_pos() - neighbour.get_pos()
-                acc_request += (dist_delta) * (self._sim.get_config_value("protected_range") / self.get_pos().distance_to(neighbour.get_pos()))
+                acc_request += (dist_delta) * (self._sim.get_config_value("protected_range") / math.sqrt(distance_squared))
             except ZeroDivisionError:
                 continue
 
         return self.__limit_force(acc_request, neighbouring_boids)
     
-    def __alignment(self):
+    def __alignment(self, neighbouring_boids):
         acc_request = pyg.math.Vector2(0, 0)
-        neighbouring_boids = self.__boids_in_radius(self._sim.get_config_value("visual_range"))
 
         if len(neighbouring_boids) == 0:
             return acc_request
         
-        for neighbour in neighbouring_boids:
+        for neighbour, distance_squared in neighbouring_boids:
             acc_request += neighbour._vel
 
         if acc_request.length_squared() == 0:
@@ -1571,14 +2712,13 @@ class Boid(BoidObject):
         
         return self.__limit_force(acc_request, neighbouring_boids)
 
-    def __cohesion(self):
+    def __cohesion(self, neighbouring_boids):
         acc_request = pyg.math.Vector2(0, 0)
-        neighbouring_boids = self.__boids_in_radius(self._sim.get_config_value("visual_range"))
 
         if len(neighbouring_boids) == 0:
             return acc_request
         
-        for neighbour in neighbouring_boids:
+        for neighbour, distance_squared in neighbouring_boids:
             acc_request += (neighbour.get_pos() - self.get_pos())
 
         if acc_request.length_squared() == 0:
@@ -1586,20 +2726,34 @@ class Boid(BoidObject):
         
         return self.__limit_force(acc_request, neighbouring_boids)
     
-    def __boids_in_radius(self, radius):
-        boids_present = []
-        for surrounding_boid in self._sim.get_boid_container():
+    def __gather_neighbours(self):
+        # One pass over nearby boids, bucketed into the protected and visual ranges with their squared distances
+        protected_boids = []
+        visual_boids = []
+        pos = self.get_pos()
+
+        protected_range_squared = self._sim.get_config_value("protected_range") ** 2
+        visual_range_squared = self._sim.get_config_value("visual_range") ** 2
+        search_radius = max(self._sim.get_config_value("protected_range"), self._sim.get_config_value("visual_range"))
+
+        for surrounding_boid in self._sim.get_boid_grid().query(pos, search_radius):
             if surrounding_boid == self:
-                pass
-            else:
-                if self.get_pos().distance_to(surrounding_boid.get_pos()) < radius:
-                    boids_present.append(surrounding_boid)
+                continue
+
+            distance_squared = pos.distance_squared_to(surrounding_boid.get_pos())
+
+            if distance_squared < protected_range_squared:
+                protected_boids.append((surrounding_boid, distance_squared))
+            if distance_squared < visual_range_squared:
+                visual_boids.append((surrounding_boid, distance_squared))
             
-        return boids_present
+        return protected_boids, visual_boids
     
     def __boundaries_in_radius(self):
         boundaries_present = []
-        for boundary in self._sim.get_boundary_container():
+
+        # Only walls whose expanded quad overlaps this boid's cell can contain it
+        for boundary in self._sim.get_boundary_index().query_point(self.get_pos()):
             if boundary.check_collision(self):
                 boundaries_present.append(boundary)
 
@@ -1633,17 +2787,6 @@ class Boid(BoidObject):
         return force
 
     def draw(self, screen):
-        if self.__pathfinding:
-            path = self.__pathfinding.get_path()
-            graph = self._sim.get_graph()
-
-            if graph and len(path) > 1:
-                points = []
-                for id in path:
-                    node = graph.get_node(id)
-                    if node:
-                        points.append((int(node.get_pos().x), int(node.get_pos().y)))  
-
         # Calculate points of the triangle
         phi = math.atan2(self._vel.y, self._vel.x)
         phi2 = 0.75 * math.pi
@@ -1657,6 +2800,39 @@ class Boid(BoidObject):
         pyg.draw.polygon(screen, Config.BOID_COLOUR, (pos1, pos2, pos3))
 
     def step(self):
+        current_destination = self.__update_destination()
+        protected_boids, visual_boids = self.__gather_neighbours()
+
+        self.__apply_avoidance()
+        self.__apply_separation(protected_boids)
+        self.__apply_alignment(visual_boids)
+        self.__apply_cohesion(visual_boids)
+        self.__apply_seeking(current_destination)
+
+        self.__integrate()
+
+    def timed_step(self, timer):
+        # The phases of step with a timer around each, the untimed step stays free of the timing overhead
+        with timer.phase("pathfinding"):
+            current_destination = self.__update_destination()
+        with timer.phase("neighbours"):
+            protected_boids, visual_boids = self.__gather_neighbours()
+
+        with timer.phase("avoid_boundary"):
+            self.__apply_avoidance()
+        with timer.phase("separation"):
+            self.__apply_separation(protected_boids)
+        with timer.phase("alignment"):
+            self.__apply_alignment(visual_boids)
+        with timer.phase("cohesion"):
+            self.__apply_cohesion(visual_boids)
+        with timer.phase("seeking"):
+            self.__apply_seeking(current_destination)
+
+        with timer.phase("move"):
+            self.__integrate()
+
+    def __update_destination(self):
         current_destination = None
 
         if self.__pathfinding:
@@ -1669,28 +2845,48 @@ class Boid(BoidObject):
                     if distance_to_target < Config.ARRIVED_RADIUS:
                         self.__pathfinding.advance_destination()
                         current_destination = self.__pathfinding.get_current_destination()
-        
+
+        return current_destination
+
+    def __apply_avoidance(self):
         self._acc += self.__avoid_boundary() * self._sim.get_config_value("avoidance")
-        self._acc += self.__separation() * self._sim.get_config_value("separation")
-        self._acc += self.__alignment() * self._sim.get_config_value("alignment")
-        self._acc += self.__cohesion() * self._sim.get_config_value("cohesion")
 
-        if current_destination is not None:
+    def __apply_separation(self, protected_boids):
+        self._acc += self.__separation(protected_boids) * self._sim.get_config_value("separation")
+
+    def __apply_alignment(self, visual_boids):
+        self._acc += self.__alignment(visual_boids) * self._sim.get_config_value("alignment")
+
+    def __apply_cohesion(self, visual_boids):
+        self._acc += self.__cohesion(visual_boids) * self._sim.get_config_value("cohesion")
+
+    def __apply_seeking(self, current_destination):
+        flow_field = self._sim.get_flow_field()
+
+        if self._sim.get_navigation() == "flow_field" and flow_field is not None:
+            self._acc += self.__seeking_flow_field(flow_field) * Config.DEFAULT_SEEKING_FACTOR
+        elif current_destination is not None:
             self._acc += self.__seeking_destination(current_destination) * Config.DEFAULT_SEEKING_FACTOR
         else:
             self._acc += self.__seeking_destination(self._sim.get_assembly_point().get_pos()) * 0.1
 
+    def __integrate(self):
         super().step()
 
         # Increment positions by velocity
         self.__move()
 
-    def assign_path(self, graph):
-        exit_id = graph.find_nearest_node(self.get_pos(), 'exit')
+    def assign_path(self, graph, exit_id=None):
+        if exit_id is None:
+            exit_id = graph.find_nearest_node(self.get_pos(), 'exit')
         assembly_nodes = graph.get_nodes_by_type('assembly')
 
+        if exit_id is None or not assembly_nodes:
+            return
+
+        # Every boid shares the tree rooted at the assembly node
         assembly_id = assembly_nodes[0].get_id()
-        path = graph.dijkstra(exit_id, assembly_id)
+        path = graph.path_to_root(exit_id, assembly_id)
 
         if path:
             self.__pathfinding = Pathfinding(path, graph)
@@ -1701,9 +2897,701 @@ class Boid(BoidObject):
     def get_vel(self):
         return self._vel
 
+    def get_pathfinding(self):
+        return self.__pathfinding
+
     def set_pos(self, value):
         self._pos = value
 
+    def set_vel(self, value):
+        self._vel = value
+
+class BoidSprites:
+    def __init__(self):
+        # Boid triangles pre-rendered at evenly spaced headings
+        self.__angles = Config.BOID_SPRITE_ANGLES
+        self.__half = Config.BOID_SIZE + 1
+        self.__sprites = []
+
+        phi2 = 0.75 * math.pi
+        centre = pyg.math.Vector2(self.__half, self.__half)
+
+        for i in range(self.__angles):
+            phi = (2 * math.pi * i) / self.__angles
+            sprite = pyg.Surface((self.__half * 2 + 1, self.__half * 2 + 1), pyg.SRCALPHA)
+
+            points = [(centre.x + (math.cos(angle) * Config.BOID_SIZE), centre.y + (math.sin(angle) * Config.BOID_SIZE)) for angle in (phi, phi + phi2, phi - phi2)]
+            pyg.draw.polygon(sprite, Config.BOID_COLOUR, points)
+            self.__sprites.append(sprite)
+
+    def draw(self, screen, positions, velocities):
+        if len(positions) == 0:
+            return
+
+        # Quantise every heading at once then hand the whole flock to a single blits call
+        headings = np.arctan2(velocities[:, 1], velocities[:, 0])
+        indices = np.rint(headings * (self.__angles / (2 * math.pi))).astype(np.int64) % self.__angles
+        corners = np.rint(positions - self.__half).astype(np.int64)
+
+        sprites = self.__sprites
+        screen.blits([(sprites[i], (x, y)) for i, (x, y) in zip(indices.tolist(), corners.tolist())], False)
+
+    def draw_pixels(self, screen, positions, mode="points"):
+        width, height = screen.get_size()
+
+        # Boids off the screen are dropped rather than clamped to the edge
+        pixels = np.floor(positions).astype(np.int64)
+        visible = (pixels[:, 0] >= 0) & (pixels[:, 0] < width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < height)
+        pixels = pixels[visible]
+
+        if len(pixels) == 0:
+            return
+
+        frame = pyg.surfarray.pixels3d(screen)
+        colour = np.array(Config.BOID_COLOUR, dtype=np.float64)
+
+        if mode == "density":
+            # Brightness of each pixel grows with the number of boids on it
+            flat = pixels[:, 0] * height + pixels[:, 1]
+            cells, counts = np.unique(flat, return_counts=True)
+            intensity = np.minimum(counts * Config.LOD_DENSITY_STEP, 255) / 255
+            frame[cells // height, cells % height] = (intensity[:, None] * colour).astype(np.uint8)
+        else:
+            frame[pixels[:, 0], pixels[:, 1]] = colour.astype(np.uint8)
+
+        # Release the pixel lock before anything else draws to the screen
+        del frame
+
+class VectorisedFlock:
+    def __init__(self, sim):
+        self.__sim = sim
+        self.__boids = []
+
+        # Struct-of-arrays flock state, row i belongs to self.__boids[i]
+        self.__pos = np.zeros((0, 2))
+        self.__vel = np.zeros((0, 2))
+        self.__acc = np.zeros((0, 2))
+
+        # Back buffers, swapped with the front buffers at the end of each step
+        self.__next_pos = np.zeros((0, 2))
+        self.__next_vel = np.zeros((0, 2))
+
+        # Path state, waypoints are padded to the longest path
+        self.__waypoints = np.zeros((0, 1, 2))
+        self.__path_length = np.zeros(0, dtype=np.int64)
+        self.__path_index = np.zeros(0, dtype=np.int64)
+        self.__has_path = np.zeros(0, dtype=bool)
+        self.__completed = np.zeros(0, dtype=bool)
+
+        self.__map_arrays = VectorisedFlock.pack_map([])
+        self.__worker_pool = None
+
+    def load(self, boids):
+        self.__boids = list(boids)
+        n = len(self.__boids)
+
+        # Position and velocity buffers live in shared memory when a worker pool is attached
+        if self.__worker_pool is not None:
+            buffers = self.__worker_pool.allocate(n)
+        else:
+            buffers = {name: np.zeros((n, 2)) for name in ["pos_a", "pos_b", "vel_a", "vel_b"]}
+
+        self.__pos = buffers["pos_a"]
+        self.__next_pos = buffers["pos_b"]
+        self.__vel = buffers["vel_a"]
+        self.__next_vel = buffers["vel_b"]
+        self.__acc = np.zeros((n, 2))
+
+        for i, boid in enumerate(self.__boids):
+            self.__pos[i] = (boid.get_pos().x, boid.get_pos().y)
+            self.__vel[i] = (boid.get_vel().x, boid.get_vel().y)
+
+        graph = self.__sim.get_graph()
+        paths = []
+        for boid in self.__boids:
+            pathfinding = boid.get_pathfinding()
+            if pathfinding is None:
+                paths.append(None)
+                continue
+
+            points = []
+            for id in pathfinding.get_path():
+                node = graph.get_node(id)
+                if node:
+                    points.append((node.get_pos().x, node.get_pos().y))
+            paths.append((points, pathfinding.get_current_destination_index(), pathfinding.get_completed()))
+
+        longest = max([len(path[0]) for path in paths if path] + [1])
+        self.__waypoints = np.zeros((n, longest, 2))
+        self.__path_length = np.zeros(n, dtype=np.int64)
+        self.__path_index = np.zeros(n, dtype=np.int64)
+        self.__has_path = np.zeros(n, dtype=bool)
+        self.__completed = np.zeros(n, dtype=bool)
+
+        for i, path in enumerate(paths):
+            if path is None:
+                continue
+
+            points, index, completed = path
+            if points:
+                self.__waypoints[i, :len(points)] = points
+            self.__path_length[i] = len(points)
+            self.__path_index[i] = index
+            self.__has_path[i] = True
+            self.__completed[i] = completed or not points
+
+        self.__map_arrays = VectorisedFlock.pack_map(self.__sim.get_boundary_container())
+        if self.__sim.get_wall_avoidance() == "distance_field":
+            self.__map_arrays["field"] = self.__sim.get_distance_field().to_arrays()
+        if self.__sim.get_navigation() == "flow_field" and self.__sim.get_flow_field() is not None:
+            self.__map_arrays["flow"] = self.__sim.get_flow_field().to_arrays()
+
+        if self.__worker_pool is not None:
+            self.__worker_pool.load_map_arrays(self.__map_arrays)
+
+    def set_worker_pool(self, worker_pool):
+        if self.__worker_pool is not None:
+            # The buffers are views onto the pool's shared memory, keep private copies before it is unlinked
+            self.__pos = np.array(self.__pos, copy=True)
+            self.__next_pos = np.array(self.__next_pos, copy=True)
+            self.__vel = np.array(self.__vel, copy=True)
+            self.__next_vel = np.array(self.__next_vel, copy=True)
+            self.__worker_pool.close()
+
+        self.__worker_pool = worker_pool
+
+    def write_back(self):
+        for i, boid in enumerate(self.__boids):
+            boid.set_pos(pyg.math.Vector2(self.__pos[i, 0], self.__pos[i, 1]))
+            boid.set_vel(pyg.math.Vector2(self.__vel[i, 0], self.__vel[i, 1]))
+
+            pathfinding = boid.get_pathfinding()
+            if pathfinding is not None and self.__has_path[i]:
+                pathfinding.set_progress(int(self.__path_index[i]), bool(self.__completed[i]))
+
+    def __update_destinations(self):
+        rows = np.arange(len(self.__pos))
+
+        # Paths whose index has run off the end are complete
+        overrun = self.__has_path & ~self.__completed & (self.__path_index >= self.__path_length)
+        self.__completed[overrun] = True
+
+        active = self.__has_path & ~self.__completed
+        current = self.__waypoints[rows, np.minimum(self.__path_index, self.__waypoints.shape[1] - 1)]
+
+        # Advance boids that have arrived at their current waypoint
+        distance_squared = ((current - self.__pos) ** 2).sum(axis=1)
+        arrived = active & (distance_squared < Config.ARRIVED_RADIUS ** 2)
+        self.__path_index[arrived] += 1
+        self.__completed[arrived & (self.__path_index >= self.__path_length)] = True
+
+        has_destination = self.__has_path & ~self.__completed
+        destinations = self.__waypoints[rows, np.minimum(self.__path_index, self.__waypoints.shape[1] - 1)]
+
+        return destinations, has_destination
+
+    def __integrate(self, acc):
+        window = self.__sim.get_window()
+        next_vel = self.__next_vel
+
+        np.add(self.__vel, acc, out=next_vel)
+        self.__acc = np.zeros_like(acc)
+
+        # Bounce against the window using the position from before the move
+        bounce_x = (self.__pos[:, 0] >= window.w) | (self.__pos[:, 0] <= 0)
+        bounce_y = (self.__pos[:, 1] >= window.h) | (self.__pos[:, 1] <= 0)
+        next_vel[bounce_x, 0] = -next_vel[bounce_x, 0]
+        next_vel[bounce_y, 1] = -next_vel[bounce_y, 1]
+
+        # Ensure velocity doesn't exceed max velocity
+        speed = np.hypot(next_vel[:, 0], next_vel[:, 1])
+        too_fast = speed > Config.MAX_SPEED
+        next_vel[too_fast] *= (Config.MAX_SPEED / speed[too_fast])[:, None]
+
+        np.add(self.__pos, next_vel, out=self.__next_pos)
+
+    def __swap_buffers(self):
+        self.__pos, self.__next_pos = self.__next_pos, self.__pos
+        self.__vel, self.__next_vel = self.__next_vel, self.__vel
+
+    def step(self):
+        if len(self.__pos) == 0:
+            return
+
+        config = {key: self.__sim.get_config_value(key) for key in ["visual_range", "protected_range", "boundary_range", "separation", "alignment", "cohesion", "avoidance"]}
+        assembly = self.__sim.get_assembly_point().get_pos()
+
+        destinations, has_destination = self.__update_destinations()
+
+        # Small flocks are cheaper to step in process than to hand out to the workers
+        if self.__worker_pool is not None and len(self.__pos) >= Config.PARALLEL_MIN_BOIDS:
+            acc = self.__worker_pool.compute_acceleration(self.__pos, self.__vel, destinations, has_destination, (assembly.x, assembly.y), config)
+        else:
+            acc = VectorisedFlock.compute_acceleration(self.__pos, self.__vel, np.arange(len(self.__pos)), self.__map_arrays, destinations, has_destination, (assembly.x, assembly.y), config)
+
+        self.__integrate(acc)
+        self.__swap_buffers()
+
+    def get_boids(self):
+        return self.__boids
+
+    def get_arrival_counts(self, flow_field=None):
+        if flow_field is not None:
+            target = flow_field.get_target()
+            arrived = ((self.__pos - (target.x, target.y)) ** 2).sum(axis=1) < Config.ASSEMBLY_SIZE ** 2
+            unreachable = ~arrived & ~flow_field.is_reachable(self.__pos)
+        else:
+            arrived = self.__has_path & self.__completed
+            unreachable = ~self.__has_path
+
+        return int(arrived.sum()), int(unreachable.sum()), len(self.__pos)
+
+    def get_positions(self):
+        return self.__pos
+
+    def get_velocities(self):
+        return self.__vel
+
+    @staticmethod
+    def pack_map(boundaries):
+        k = len(boundaries)
+
+        boundary_index = BoundaryIndex(Config.BOUNDARY_INDEX_CELL_SIZE)
+        boundary_index.build(boundaries)
+        origin, size, cell_starts, cell_walls = boundary_index.to_arrays(boundaries)
+
+        return {"origin": origin, "size": size, "cell_starts": cell_starts, "cell_walls": cell_walls,
+                "quads": np.array([[(point.x, point.y) for point in boundary.get_expanded_points()] for boundary in boundaries], dtype=np.float64).reshape(k, 4, 2),
+                "starts": np.array([(boundary.get_pos()[0].x, boundary.get_pos()[0].y) for boundary in boundaries], dtype=np.float64).reshape(k, 2),
+                "ends": np.array([(boundary.get_pos()[1].x, boundary.get_pos()[1].y) for boundary in boundaries], dtype=np.float64).reshape(k, 2),
+                "perpendiculars": np.array([(boundary.get_perpendicular_vector().x, boundary.get_perpendicular_vector().y) for boundary in boundaries], dtype=np.float64).reshape(k, 2)}
+
+    @staticmethod
+    def compute_acceleration(pos, vel, rows, map_arrays, destinations, has_destination, assembly, config):
+        # Acceleration for the boids in rows, reading every other boid from pos and vel
+        acc = np.zeros((len(rows), 2))
+
+        for chunk_start in range(0, len(rows), Config.VECTOR_CHUNK_SIZE):
+            chunk = rows[chunk_start:chunk_start + Config.VECTOR_CHUNK_SIZE]
+            chunk_acc = acc[chunk_start:chunk_start + Config.VECTOR_CHUNK_SIZE]
+
+            if "field" in map_arrays:
+                chunk_acc += VectorisedFlock.field_acceleration(pos[chunk], vel[chunk], map_arrays, config["boundary_range"]) * config["avoidance"]
+            else:
+                chunk_acc += VectorisedFlock.boundary_acceleration(pos[chunk], vel[chunk], map_arrays, config["boundary_range"]) * config["avoidance"]
+
+            separation, alignment, cohesion = VectorisedFlock.flocking_acceleration(pos, vel, chunk, config["protected_range"], config["visual_range"])
+            chunk_acc += separation * config["separation"]
+            chunk_acc += alignment * config["alignment"]
+            chunk_acc += cohesion * config["cohesion"]
+
+            if "flow" in map_arrays:
+                chunk_acc += VectorisedFlock.flow_acceleration(pos[chunk], vel[chunk], map_arrays["flow"]) * Config.DEFAULT_SEEKING_FACTOR
+                continue
+
+            # Boids without a waypoint drift gently towards the assembly point
+            targets = np.where(has_destination[chunk][:, None], destinations[chunk], np.asarray(assembly, dtype=np.float64))
+            factors = np.where(has_destination[chunk], Config.DEFAULT_SEEKING_FACTOR, 0.1)
+            chunk_acc += VectorisedFlock.seeking_acceleration(pos[chunk], vel[chunk], targets) * factors[:, None]
+
+        return acc
+
+    @staticmethod
+    def neighbour_pairs(pos, rows, radius):
+        # Cell list over every boid, returning (row, neighbour, squared distance) for all pairs within radius
+        cells = np.floor(pos / radius).astype(np.int64)
+        cells -= cells.min(axis=0) - 1
+        height = cells[:, 1].max() + 2
+
+        keys = cells[:, 0] * height + cells[:, 1]
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        row_cells = cells[rows]
+        owner_parts = []
+        candidate_parts = []
+
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbour_keys = (row_cells[:, 0] + dx) * height + (row_cells[:, 1] + dy)
+                start = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+                end = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+                counts = end - start
+
+                total = counts.sum()
+                if total == 0:
+                    continue
+
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                owner_parts.append(np.repeat(np.arange(len(rows)), counts))
+                candidate_parts.append(order[np.repeat(start, counts) + offsets])
+
+        if not owner_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        owners = np.concatenate(owner_parts)
+        candidates = np.concatenate(candidate_parts)
+
+        delta = pos[candidates] - pos[rows[owners]]
+        distance_squared = (delta ** 2).sum(axis=1)
+        within = (distance_squared < radius ** 2) & (candidates != rows[owners])
+
+        return owners[within], candidates[within], distance_squared[within]
+
+    @staticmethod
+    def limit_force(force, counts, vel):
+        # Array version of Boid.__limit_force, rows with no neighbours stay at zero
+        result = np.zeros_like(force)
+        has_neighbours = counts > 0
+
+        averaged = force[has_neighbours] / counts[has_neighbours][:, None]
+        length = np.hypot(averaged[:, 0], averaged[:, 1])
+        steer = np.round(length, 3) > 0
+
+        limited = averaged.copy()
+        limited[steer] = averaged[steer] / length[steer][:, None] * Config.MAX_SPEED - vel[has_neighbours][steer]
+
+        limited_length = np.hypot(limited[:, 0], limited[:, 1])
+        too_strong = steer & (limited_length > Config.MAX_ACC_REQUEST)
+        limited[too_strong] *= (Config.MAX_ACC_REQUEST / limited_length[too_strong])[:, None]
+
+        result[has_neighbours] = limited
+        return result
+
+    @staticmethod
+    def flocking_acceleration(pos, vel, rows, protected_range, visual_range):
+        n = len(rows)
+        owners, neighbours, distance_squared = VectorisedFlock.neighbour_pairs(pos, rows, max(protected_range, visual_range))
+        delta = pos[neighbours] - pos[rows[owners]]
+
+        # Separation pushes away from boids in the protected range, weighted by inverse distance
+        protected = distance_squared < protected_range ** 2
+        distance = np.sqrt(distance_squared[protected])
+        separated = distance > 0
+        push = -delta[protected][separated] * (protected_range / distance[separated])[:, None]
+        push_owners = owners[protected][separated]
+        separation = np.stack([np.bincount(push_owners, push[:, 0], n), np.bincount(push_owners, push[:, 1], n)], axis=1)
+        separation = VectorisedFlock.limit_force(separation, np.bincount(owners[protected], minlength=n), vel[rows])
+
+        # Alignment and cohesion share the visual range neighbours
+        visible = distance_squared < visual_range ** 2
+        visible_owners = owners[visible]
+        visible_counts = np.bincount(visible_owners, minlength=n)
+
+        heading = vel[neighbours[visible]]
+        alignment = np.stack([np.bincount(visible_owners, heading[:, 0], n), np.bincount(visible_owners, heading[:, 1], n)], axis=1)
+        alignment = VectorisedFlock.limit_force(alignment, visible_counts, vel[rows])
+
+        offset = delta[visible]
+        cohesion = np.stack([np.bincount(visible_owners, offset[:, 0], n), np.bincount(visible_owners, offset[:, 1], n)], axis=1)
+        cohesion = VectorisedFlock.limit_force(cohesion, visible_counts, vel[rows])
+
+        return separation, alignment, cohesion
+
+    @staticmethod
+    def boundary_acceleration(pos, vel, map_arrays, boundary_range):
+        n = len(pos)
+        acc = np.zeros((n, 2))
+        quads = map_arrays["quads"]
+        k = len(quads)
+
+        if k == 0 or n == 0:
+            return acc
+
+        # Candidate walls come from the cell each boid sits in
+        cells = np.floor(pos / Config.BOUNDARY_INDEX_CELL_SIZE).astype(np.int64) - map_arrays["origin"]
+        in_grid = (cells[:, 0] >= 0) & (cells[:, 0] < map_arrays["size"][0]) & (cells[:, 1] >= 0) & (cells[:, 1] < map_arrays["size"][1])
+        flat = np.where(in_grid, cells[:, 0] * map_arrays["size"][1] + cells[:, 1], 0)
+
+        start = map_arrays["cell_starts"][flat]
+        candidate_counts = np.where(in_grid, map_arrays["cell_starts"][flat + 1] - start, 0)
+        total = candidate_counts.sum()
+
+        if total == 0:
+            return acc
+
+        offsets = np.arange(total) - np.repeat(np.cumsum(candidate_counts) - candidate_counts, candidate_counts)
+        owners = np.repeat(np.arange(n), candidate_counts)
+        candidates = map_arrays["cell_walls"][np.repeat(start, candidate_counts) + offsets]
+
+        # Same test as Boundary.check_collision on each candidate
+        inside = np.ones(total, dtype=bool)
+        point = pos[owners]
+        for i in range(4):
+            vertex_a = quads[candidates, i]
+            edge = quads[candidates, (i + 1) % 4] - vertex_a
+            point_vector = point - vertex_a
+            inside &= (edge[:, 0] * point_vector[:, 1]) - (edge[:, 1] * point_vector[:, 0]) <= 0
+
+        counts = np.bincount(owners[inside], minlength=n)
+
+        # Candidates are in container order, so the first hit per boid is the first nearby boundary
+        first = np.zeros(n, dtype=np.int64)
+        hit_owners, first_hits = np.unique(owners[inside], return_index=True)
+        first[hit_owners] = candidates[inside][first_hits]
+
+        rows = np.nonzero(counts)[0]
+        if len(rows) == 0:
+            return acc
+
+        # Only the first nearby boundary steers the boid, matching Boid.__avoid_boundary
+        wall = first[rows]
+        force = VectorisedFlock.__wall_force(pos[rows], vel[rows], wall, map_arrays, boundary_range)
+        acc[rows] = VectorisedFlock.limit_force(force, counts[rows], vel[rows])
+
+        return acc
+
+    @staticmethod
+    def field_acceleration(pos, vel, map_arrays, boundary_range):
+        acc = np.zeros_like(pos)
+        distance, gradient, nearest = DistanceField.sample_arrays(map_arrays["field"], pos)
+
+        rows = np.nonzero((distance < 0) & (nearest >= 0))[0]
+        if len(rows) == 0:
+            return acc
+
+        # Push down the gradient, falling back to the nearest wall's normal where it is flat
+        gradient = gradient[rows]
+        length = np.hypot(gradient[:, 0], gradient[:, 1])
+        flat = length == 0
+        force = np.zeros((len(rows), 2))
+        force[~flat] = gradient[~flat] / length[~flat][:, None] * boundary_range
+        force[flat] = map_arrays["perpendiculars"][nearest[rows][flat]] * boundary_range
+
+        acc[rows] = VectorisedFlock.limit_force(force, np.ones(len(rows), dtype=np.int64), vel[rows])
+        return acc
+
+    @staticmethod
+    def __wall_force(pos, vel, wall, map_arrays, boundary_range):
+        quads = map_arrays["quads"][wall]
+        perpendiculars = map_arrays["perpendiculars"][wall]
+        force = np.zeros_like(pos)
+
+        # Boundary.will_collide, keeping the hit on the expanded quad closest to the boid
+        next_pos = pos + vel
+        best_distance = np.full(len(pos), np.inf)
+        collision_point = np.zeros_like(pos)
+
+        for i in range(4):
+            line_start = quads[:, i]
+            line_end = quads[:, (i + 1) % 4]
+            hit, ua, intersect = Helper.batch_lines_intersect(pos, next_pos, line_start, line_end, pairwise=True)
+
+            distance = ((intersect - pos) ** 2).sum(axis=1)
+            closer = hit & (distance < best_distance)
+            best_distance[closer] = distance[closer]
+            collision_point[closer] = intersect[closer]
+
+        will_collide = np.isfinite(best_distance)
+
+        reverse_vector = pos - collision_point
+        reverse_length = np.hypot(reverse_vector[:, 0], reverse_vector[:, 1])
+        reversible = will_collide & (reverse_length > 0)
+        force[reversible] = reverse_vector[reversible] / reverse_length[reversible][:, None] * (boundary_range * 5)
+
+        # Otherwise push away from the closest point on the wall itself
+        starts = map_arrays["starts"][wall]
+        boundary_vector = map_arrays["ends"][wall] - starts
+        boundary_length_squared = (boundary_vector ** 2).sum(axis=1)
+        safe_length_squared = np.where(boundary_length_squared < 0.01, 1, boundary_length_squared)
+        t = np.clip(((pos - starts) * boundary_vector).sum(axis=1) / safe_length_squared, 0, 1)
+        t[boundary_length_squared < 0.01] = 0
+        closest_point = starts + boundary_vector * t[:, None]
+
+        dist_delta = pos - closest_point
+        distance = np.hypot(dist_delta[:, 0], dist_delta[:, 1])
+        pushable = ~will_collide & (distance > 0)
+        force[pushable] = dist_delta[pushable] * (boundary_range / distance[pushable])[:, None]
+
+        on_wall = ~reversible & ~pushable
+        force[on_wall] = perpendiculars[on_wall] * boundary_range
+
+        return force
+
+    @staticmethod
+    def flow_acceleration(pos, vel, flow):
+        acc = np.zeros_like(pos)
+        direction = FlowField.sample_arrays(flow, pos)
+
+        distance_squared = ((pos - flow["target"]) ** 2).sum(axis=1)
+        steering = (distance_squared >= Config.ARRIVED_RADIUS ** 2) & ((direction ** 2).sum(axis=1) > 0)
+        acc[steering] = direction[steering] * Config.MAX_SPEED - vel[steering]
+
+        return acc
+
+    @staticmethod
+    def seeking_acceleration(pos, vel, targets):
+        destination_vector = targets - pos
+        distance = np.hypot(destination_vector[:, 0], destination_vector[:, 1])
+        seeking = distance >= Config.ARRIVED_RADIUS
+
+        acc = np.zeros_like(pos)
+        acc[seeking] = destination_vector[seeking] / distance[seeking][:, None] * Config.MAX_SPEED - vel[seeking]
+
+        return acc
+
+class FlockWorkerPool:
+    def __init__(self, workers=None):
+        self.__worker_count = workers or os.cpu_count() or 1
+        self.__context = multiprocessing.get_context("spawn")
+        self.__task_queues = []
+        self.__result_queue = None
+        self.__processes = []
+
+        # Shared memory blocks and the array views onto them, keyed by buffer name
+        self.__blocks = {}
+        self.__views = {}
+
+    def __start(self):
+        if self.__processes:
+            return
+
+        self.__result_queue = self.__context.Queue()
+        for i in range(self.__worker_count):
+            task_queue = self.__context.Queue()
+            process = self.__context.Process(target=FlockWorkerPool.worker_loop, args=(task_queue, self.__result_queue), daemon=True)
+            process.start()
+
+            self.__task_queues.append(task_queue)
+            self.__processes.append(process)
+
+    def __broadcast(self, task):
+        for task_queue in self.__task_queues:
+            task_queue.put(task)
+
+        self.__collect_results()
+
+    def __collect_results(self):
+        # A worker that has died never answers, so poll and check they are all still running
+        for i in range(len(self.__task_queues)):
+            while True:
+                try:
+                    self.__result_queue.get(timeout=Config.PARALLEL_POLL_INTERVAL)
+                    break
+                except queue.Empty:
+                    if not all(process.is_alive() for process in self.__processes):
+                        raise RuntimeError("A flock worker process exited unexpectedly")
+
+    def __release_blocks(self):
+        if self.__processes and all(process.is_alive() for process in self.__processes):
+            self.__broadcast(("release",))
+
+        # Drop our own views before unmapping the blocks
+        self.__views = {}
+
+        for block in self.__blocks.values():
+            block.close()
+            block.unlink()
+
+        self.__blocks = {}
+
+    def __describe(self, name):
+        view = self.__views[name]
+        return (self.__blocks[name].name, view.shape, view.dtype.str)
+
+    def __name_of(self, array):
+        for name, view in self.__views.items():
+            if view is array:
+                return name
+
+        return None
+
+    def allocate(self, n):
+        self.__start()
+        self.__release_blocks()
+
+        layout = {"pos_a": ((n, 2), np.float64), "pos_b": ((n, 2), np.float64),
+                  "vel_a": ((n, 2), np.float64), "vel_b": ((n, 2), np.float64),
+                  "destinations": ((n, 2), np.float64), "has_destination": ((n,), np.bool_),
+                  "acc": ((n, 2), np.float64)}
+
+        for name, (shape, dtype) in layout.items():
+            size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self.__blocks[name] = block
+            self.__views[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            self.__views[name].fill(0)
+
+        return self.__views
+
+    def load_map_arrays(self, map_arrays):
+        self.__start()
+        self.__broadcast(("map", map_arrays))
+
+    def compute_acceleration(self, pos, vel, destinations, has_destination, assembly, config):
+        n = len(pos)
+        self.__views["destinations"][:] = destinations
+        self.__views["has_destination"][:] = has_destination
+
+        # Workers read whichever buffers are currently the front ones
+        layout = {"pos": self.__describe(self.__name_of(pos)),
+                  "vel": self.__describe(self.__name_of(vel)),
+                  "destinations": self.__describe("destinations"),
+                  "has_destination": self.__describe("has_destination"),
+                  "acc": self.__describe("acc")}
+
+        bounds = np.linspace(0, n, len(self.__task_queues) + 1).astype(np.int64)
+        for i, task_queue in enumerate(self.__task_queues):
+            task_queue.put(("step", layout, int(bounds[i]), int(bounds[i + 1]), assembly, config))
+
+        self.__collect_results()
+
+        return self.__views["acc"].copy()
+
+    def close(self):
+        if self.__processes:
+            self.__release_blocks()
+
+            for task_queue in self.__task_queues:
+                task_queue.put(("stop",))
+            for process in self.__processes:
+                process.join(timeout=5)
+        else:
+            self.__release_blocks()
+
+        self.__task_queues = []
+        self.__processes = []
+
+    @staticmethod
+    def worker_loop(task_queue, result_queue):
+        attached = {}
+        map_arrays = VectorisedFlock.pack_map([])
+
+        while True:
+            task = task_queue.get()
+
+            if task[0] == "stop":
+                break
+
+            elif task[0] == "release":
+                for block in attached.values():
+                    block.close()
+                attached = {}
+
+            elif task[0] == "map":
+                map_arrays = task[1]
+
+            elif task[0] == "step":
+                layout, start, end, assembly, config = task[1:]
+
+                arrays = {}
+                for role, (name, shape, dtype) in layout.items():
+                    if name not in attached:
+                        attached[name] = shared_memory.SharedMemory(name=name)
+                    arrays[role] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=attached[name].buf)
+
+                # Each worker only writes its own slice of the acceleration buffer
+                if end > start:
+                    rows = np.arange(start, end)
+                    arrays["acc"][start:end] = VectorisedFlock.compute_acceleration(arrays["pos"], arrays["vel"], rows, map_arrays, arrays["destinations"], arrays["has_destination"], assembly, config)
+
+                arrays = {}
+
+            result_queue.put(task[0])
+
+        for block in attached.values():
+            block.close()
+
 class Boundary:
     def __init__(self, pos):
         self.__pos = pos
@@ -1808,6 +3696,618 @@ class AssemblyPoint:
     def get_pos(self):
         return self.__pos
 
+class ProfileCapture:
+    def __init__(self, count, label):
+        # Counts frames or steps depending on who ticks it
+        self.__profiler = cProfile.Profile()
+        self.__remaining = count
+        self.__label = label
+        self.__running = False
+        self.__files = None
+
+    def start(self):
+        # Fails when another profiler is already running, such as python -m cProfile or a capture on another thread
+        try:
+            self.__profiler.enable()
+        except ValueError as e:
+            print(f"Could not start profiling: {e}", file=sys.stderr)
+            return False
+
+        self.__running = True
+        return True
+
+    def tick(self):
+        self.__remaining -= 1
+        if self.__remaining > 0:
+            return False
+
+        self.stop()
+        return True
+
+    def stop(self):
+        if not self.__running:
+            return
+
+        self.__profiler.disable()
+        self.__running = False
+        self.__files = self.__write()
+
+    def __write(self):
+        os.makedirs(Config.PROFILES_FOLDER, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(Config.PROFILES_FOLDER, f"{self.__label}_{stamp}")
+
+        self.__profiler.dump_stats(f"{base}.pstats")
+
+        # Text summary of the most expensive functions, by cumulative then own time
+        stream = io.StringIO()
+        stats = pstats.Stats(self.__profiler, stream=stream)
+        stats.sort_stats("cumulative").print_stats(Config.PROFILE_TOP_FUNCTIONS)
+        stats.sort_stats("tottime").print_stats(Config.PROFILE_TOP_FUNCTIONS)
+
+        with open(f"{base}.txt", 'w') as file:
+            file.write(stream.getvalue())
+
+        print(f"Profile written to {base}.pstats", file=sys.stderr)
+        return {"pstats": f"{base}.pstats", "summary": f"{base}.txt"}
+
+    def get_files(self):
+        return self.__files
+
+class StepTimer:
+    PHASES = ["grid", "pathfinding", "neighbours", "avoid_boundary", "separation", "alignment", "cohesion", "seeking", "move", "step"]
+
+    def __init__(self, window=None):
+        window = window if window is not None else Config.STEP_TIMING_WINDOW
+
+        # Phase times are summed over every boid in a step, then kept per step for the rolling window
+        self.__current = dict.fromkeys(StepTimer.PHASES, 0.0)
+        self.__history = {phase: collections.deque(maxlen=window) for phase in StepTimer.PHASES}
+        self.__steps = 0
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__current[phase] += time.perf_counter() - start
+
+    def end_step(self):
+        for phase, seconds in self.__current.items():
+            self.__history[phase].append(seconds)
+            self.__current[phase] = 0.0
+
+        self.__steps += 1
+
+    def get_stats(self):
+        # Milliseconds per step over the window, phases never hit (the boid phases on the array engines) are left out
+        stats = {}
+        for phase, history in self.__history.items():
+            if not any(history):
+                continue
+
+            values = np.array(history) * 1000
+            stats[phase] = {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+                            "max": float(values.max()), "last": float(values[-1])}
+
+        return stats
+
+    def get_history(self, phase):
+        return self.__history[phase]
+
+    def get_steps(self):
+        return self.__steps
+
+    def format_stats(self):
+        lines = [f"{'phase':<16}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for phase, values in self.get_stats().items():
+            lines.append(f"{phase:<16}{values['p50']:>10.3f}{values['p95']:>10.3f}{values['max']:>10.3f}")
+
+        return "\n".join(lines)
+
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.__cell_size = cell_size
+        self.__cells = {}
+        self.__count = 0
+
+    def __cell_key(self, pos):
+        return (int(pos[0] // self.__cell_size), int(pos[1] // self.__cell_size))
+
+    def clear(self, cell_size=None):
+        if cell_size:
+            self.__cell_size = cell_size
+
+        self.__cells = {}
+        self.__count = 0
+
+    def insert(self, item, pos):
+        key = self.__cell_key(pos)
+        self.__count += 1
+
+        if key in self.__cells:
+            self.__cells[key].append(item)
+        else:
+            self.__cells[key] = [item]
+
+    def remove(self, item, pos):
+        key = self.__cell_key(pos)
+
+        if key in self.__cells and item in self.__cells[key]:
+            self.__cells[key].remove(item)
+            self.__count -= 1
+
+            if not self.__cells[key]:
+                self.__cells.pop(key)
+
+    def nearest(self, pos):
+        # Search rings of cells outwards until no unchecked cell can hold anything closer, items need get_pos
+        if self.__count == 0:
+            return None
+
+        centre_x, centre_y = self.__cell_key(pos)
+        pos = pyg.math.Vector2(pos)
+        nearest = None
+        smallest_dist = float('inf')
+
+        for items in self.__ring_search(centre_x, centre_y, lambda: smallest_dist):
+            for item in items:
+                dist_squared = pos.distance_squared_to(item.get_pos())
+                if dist_squared < smallest_dist:
+                    smallest_dist = dist_squared
+                    nearest = item
+
+        return nearest
+
+    def __ring(self, centre_x, centre_y, ring):
+        if ring == 0:
+            return list(self.__cells.get((centre_x, centre_y), []))
+
+        items = []
+        for x in range(centre_x - ring, centre_x + ring + 1):
+            for y in range(centre_y - ring, centre_y + ring + 1):
+                if max(abs(x - centre_x), abs(y - centre_y)) == ring:
+                    items.extend(self.__cells.get((x, y), []))
+
+        return items
+
+    def __ring_search(self, centre_x, centre_y, worst_dist):
+        # Yields each non-empty ring outwards until every item is checked or no further ring can beat worst_dist()
+        checked = 0
+        ring = 0
+
+        while checked < self.__count:
+            if checked and ((ring - 1) * self.__cell_size) ** 2 > worst_dist():
+                return
+
+            items = self.__ring(centre_x, centre_y, ring)
+            ring += 1
+            if items:
+                checked += len(items)
+                yield items
+
+    def nearest_many(self, positions):
+        # Batched nearest for an (n, 2) array, positions sharing a cell share one ring search
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        nearest = [None] * len(positions)
+        smallest_dist = np.full(len(positions), np.inf)
+
+        if self.__count == 0 or len(positions) == 0:
+            return nearest, smallest_dist
+
+        keys = np.floor(positions / self.__cell_size).astype(np.int64)
+        cells, inverse = np.unique(keys, axis=0, return_inverse=True)
+        order = np.argsort(inverse.reshape(-1), kind="stable")
+        groups = np.split(order, np.cumsum(np.bincount(inverse.reshape(-1)))[:-1])
+
+        for (centre_x, centre_y), rows in zip(cells.tolist(), groups):
+            group = positions[rows]
+            group_dist = smallest_dist[rows]
+
+            # The group stops searching on its worst distance found so far
+            for items in self.__ring_search(centre_x, centre_y, lambda: group_dist.max()):
+                item_positions = np.array([(item.get_pos()[0], item.get_pos()[1]) for item in items])
+                chunk_size = max(1, Config.VECTOR_CHUNK_SIZE * 16 // len(items))
+
+                for chunk_start in range(0, len(rows), chunk_size):
+                    chunk = slice(chunk_start, chunk_start + chunk_size)
+                    dist_squared = ((group[chunk, None, :] - item_positions[None, :, :]) ** 2).sum(axis=2)
+                    closest = dist_squared.argmin(axis=1)
+                    closest_dist = dist_squared[np.arange(len(closest)), closest]
+
+                    closer = np.nonzero(closest_dist < group_dist[chunk])[0]
+                    group_dist[chunk_start + closer] = closest_dist[closer]
+                    for row, item_index in zip((rows[chunk_start + closer]).tolist(), closest[closer].tolist()):
+                        nearest[row] = items[item_index]
+
+            smallest_dist[rows] = group_dist
+
+        return nearest, smallest_dist
+
+    def query(self, pos, radius):
+        # Return every item in the cells overlapped by the square around the radius, callers check exact distance
+        min_x, min_y = self.__cell_key((pos[0] - radius, pos[1] - radius))
+        max_x, max_y = self.__cell_key((pos[0] + radius, pos[1] + radius))
+
+        items = []
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                cell = self.__cells.get((x, y))
+                if cell:
+                    items.extend(cell)
+
+        return items
+
+    def get_cell_size(self):
+        return self.__cell_size
+
+class FlowField:
+    def __init__(self, width, height, cell_size):
+        self.__cell_size = cell_size
+        self.__columns = int(math.ceil(width / cell_size))
+        self.__rows = int(math.ceil(height / cell_size))
+        self.__target = pyg.math.Vector2(0, 0)
+
+        # Path distance to the target from each cell and the unit direction to follow from it
+        self.__distance = np.full((self.__rows, self.__columns), np.inf)
+        self.__direction = np.zeros((self.__rows, self.__columns, 2))
+        self.__reachable = np.zeros((self.__rows, self.__columns), dtype=bool)
+
+    def __blocked_cells(self, boundaries):
+        # Cells whose centre is within a wall's radius cannot be walked through, narrow doorways stay open
+        blocked = np.zeros((self.__rows, self.__columns), dtype=bool)
+        clearance = Config.BOUNDARY_RADIUS
+
+        for boundary in boundaries:
+            start, end = boundary.get_pos()
+
+            min_column = max(0, int((min(start.x, end.x) - clearance) // self.__cell_size))
+            max_column = min(self.__columns - 1, int((max(start.x, end.x) + clearance) // self.__cell_size))
+            min_row = max(0, int((min(start.y, end.y) - clearance) // self.__cell_size))
+            max_row = min(self.__rows - 1, int((max(start.y, end.y) + clearance) // self.__cell_size))
+
+            if min_column > max_column or min_row > max_row:
+                continue
+
+            xs = (np.arange(min_column, max_column + 1) + 0.5) * self.__cell_size
+            ys = (np.arange(min_row, max_row + 1) + 0.5) * self.__cell_size
+            point_x, point_y = np.meshgrid(xs, ys)
+
+            boundary_vector = end - start
+            length_squared = boundary_vector.length_squared()
+            if length_squared < 0.01:
+                t = np.zeros_like(point_x)
+            else:
+                t = np.clip(((point_x - start.x) * boundary_vector.x + (point_y - start.y) * boundary_vector.y) / length_squared, 0, 1)
+
+            distance = np.hypot(point_x - (start.x + boundary_vector.x * t), point_y - (start.y + boundary_vector.y * t))
+            blocked[min_row:max_row + 1, min_column:max_column + 1] |= distance < clearance
+
+        return blocked
+
+    def __crossing_moves(self, boundaries, moves):
+        # (rows, columns, moves) mask of steps from a cell centre to its neighbour's centre that pass through a wall
+        crossing = np.zeros((self.__rows, self.__columns, len(moves)), dtype=bool)
+        cell_rows, cell_columns, wall_starts, wall_ends = [], [], [], []
+
+        # Only cells within a cell of each wall's bounding box can have a move across it
+        for boundary in boundaries:
+            start, end = boundary.get_pos()
+
+            min_column = max(0, int(min(start.x, end.x) // self.__cell_size) - 1)
+            max_column = min(self.__columns - 1, int(max(start.x, end.x) // self.__cell_size) + 1)
+            min_row = max(0, int(min(start.y, end.y) // self.__cell_size) - 1)
+            max_row = min(self.__rows - 1, int(max(start.y, end.y) // self.__cell_size) + 1)
+
+            if min_column > max_column or min_row > max_row:
+                continue
+
+            rows, columns = np.meshgrid(np.arange(min_row, max_row + 1), np.arange(min_column, max_column + 1), indexing="ij")
+            cell_rows.append(rows.ravel())
+            cell_columns.append(columns.ravel())
+            wall_starts.append(np.tile((start.x, start.y), (rows.size, 1)))
+            wall_ends.append(np.tile((end.x, end.y), (rows.size, 1)))
+
+        if not cell_rows:
+            return crossing
+
+        cell_rows = np.concatenate(cell_rows)
+        cell_columns = np.concatenate(cell_columns)
+        wall_starts = np.concatenate(wall_starts)
+        wall_ends = np.concatenate(wall_ends)
+        centres = np.stack([(cell_columns + 0.5) * self.__cell_size, (cell_rows + 0.5) * self.__cell_size], axis=1)
+
+        for i, (dr, dc, cost) in enumerate(moves):
+            hit, ua, points = Helper.batch_lines_intersect(centres, centres + (dc * self.__cell_size, dr * self.__cell_size), wall_starts, wall_ends, pairwise=True)
+            crossing[cell_rows[hit], cell_columns[hit], i] = True
+
+        return crossing
+
+    def build(self, boundaries, target):
+        self.__target = pyg.math.Vector2(target)
+        blocked = self.__blocked_cells(boundaries)
+
+        target_column = min(max(int(self.__target.x // self.__cell_size), 0), self.__columns - 1)
+        target_row = min(max(int(self.__target.y // self.__cell_size), 0), self.__rows - 1)
+        blocked[target_row, target_column] = False
+
+        # Dijkstra outwards from the target over the 8-connected grid
+        distance = np.full((self.__rows, self.__columns), np.inf)
+        distance[target_row, target_column] = 0
+        queue = [(0, target_row, target_column)]
+        moves = [(dr, dc, math.hypot(dr, dc)) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc]
+        crossing = self.__crossing_moves(boundaries, moves)
+
+        while queue:
+            current, row, column = heapq.heappop(queue)
+            if current > distance[row, column]:
+                continue
+
+            for i, (dr, dc, cost) in enumerate(moves):
+                r, c = row + dr, column + dc
+                if r < 0 or r >= self.__rows or c < 0 or c >= self.__columns or blocked[r, c] or crossing[row, column, i]:
+                    continue
+
+                # No cutting corners past a blocked cell
+                if dr and dc and (blocked[row, c] or blocked[r, column]):
+                    continue
+
+                new_distance = current + cost
+                if new_distance < distance[r, c]:
+                    distance[r, c] = new_distance
+                    heapq.heappush(queue, (new_distance, r, c))
+
+        self.__distance = distance
+        self.__direction = np.zeros((self.__rows, self.__columns, 2))
+
+        # Each cell points at its lowest neighbour, so blocked cells beside a wall still lead back into the reachable band
+        padded = np.full((self.__rows + 2, self.__columns + 2), np.inf)
+        padded[1:-1, 1:-1] = distance
+        best = distance.copy()
+        for i, (dr, dc, cost) in enumerate(moves):
+            neighbour = padded[1 + dr:1 + dr + self.__rows, 1 + dc:1 + dc + self.__columns]
+            lower = (neighbour < best) & ~crossing[:, :, i]
+            best[lower] = neighbour[lower]
+            self.__direction[lower] = (dc / cost, dr / cost)
+
+        centres_x, centres_y = np.meshgrid((np.arange(self.__columns) + 0.5) * self.__cell_size, (np.arange(self.__rows) + 0.5) * self.__cell_size)
+        straight = np.stack([self.__target.x - centres_x, self.__target.y - centres_y], axis=2)
+        straight_length = np.hypot(straight[:, :, 0], straight[:, :, 1])
+        straight_length[straight_length == 0] = 1
+        straight /= straight_length[:, :, None]
+
+        # Only cells with no reachable neighbour, and the target cell itself, point straight at the target
+        fallback = ~np.isfinite(best) | (distance == 0)
+        self.__direction[fallback] = straight[fallback]
+        self.__reachable = np.isfinite(best)
+
+    def sample(self, pos):
+        column = min(max(int(pos[0] // self.__cell_size), 0), self.__columns - 1)
+        row = min(max(int(pos[1] // self.__cell_size), 0), self.__rows - 1)
+
+        return pyg.math.Vector2(self.__direction[row, column, 0], self.__direction[row, column, 1])
+
+    def to_arrays(self):
+        return {"cell_size": self.__cell_size, "direction": self.__direction, "target": np.array([self.__target.x, self.__target.y])}
+
+    @staticmethod
+    def sample_arrays(flow, points):
+        rows, columns = flow["direction"].shape[:2]
+        column = np.clip(np.floor(points[:, 0] / flow["cell_size"]).astype(np.int64), 0, columns - 1)
+        row = np.clip(np.floor(points[:, 1] / flow["cell_size"]).astype(np.int64), 0, rows - 1)
+
+        return flow["direction"][row, column]
+
+    def is_reachable(self, points):
+        # Cells in or beside the reachable band, for an (n, 2) array
+        column = np.clip(np.floor(points[:, 0] / self.__cell_size).astype(np.int64), 0, self.__columns - 1)
+        row = np.clip(np.floor(points[:, 1] / self.__cell_size).astype(np.int64), 0, self.__rows - 1)
+
+        return self.__reachable[row, column]
+
+    def get_distance(self):
+        return self.__distance
+
+    def get_target(self):
+        return self.__target
+
+class DistanceField:
+    def __init__(self, width, height, resolution):
+        self.__resolution = resolution
+        self.__columns = int(math.ceil(width / resolution)) + 1
+        self.__rows = int(math.ceil(height / resolution)) + 1
+        self.__boundaries = []
+
+        # Signed distance to the nearest wall's radius, its gradient and which wall is nearest
+        self.__distance = np.full((self.__rows, self.__columns), Config.DISTANCE_FIELD_RANGE - Config.BOUNDARY_RADIUS, dtype=np.float64)
+        self.__gradient = np.zeros((self.__rows, self.__columns, 2))
+        self.__nearest = np.full((self.__rows, self.__columns), -1, dtype=np.int64)
+
+    def build(self, boundaries):
+        self.__boundaries = list(boundaries)
+        unsigned = np.full((self.__rows, self.__columns), float(Config.DISTANCE_FIELD_RANGE))
+        self.__nearest.fill(-1)
+
+        for i, boundary in enumerate(self.__boundaries):
+            start, end = boundary.get_pos()
+
+            # Only the window within range of the wall can change
+            min_column = max(0, int((min(start.x, end.x) - Config.DISTANCE_FIELD_RANGE) // self.__resolution))
+            max_column = min(self.__columns - 1, int((max(start.x, end.x) + Config.DISTANCE_FIELD_RANGE) // self.__resolution) + 1)
+            min_row = max(0, int((min(start.y, end.y) - Config.DISTANCE_FIELD_RANGE) // self.__resolution))
+            max_row = min(self.__rows - 1, int((max(start.y, end.y) + Config.DISTANCE_FIELD_RANGE) // self.__resolution) + 1)
+
+            if min_column > max_column or min_row > max_row:
+                continue
+
+            xs = np.arange(min_column, max_column + 1) * self.__resolution
+            ys = np.arange(min_row, max_row + 1) * self.__resolution
+            point_x, point_y = np.meshgrid(xs, ys)
+
+            boundary_vector = end - start
+            length_squared = boundary_vector.length_squared()
+            if length_squared < 0.01:
+                t = np.zeros_like(point_x)
+            else:
+                t = np.clip(((point_x - start.x) * boundary_vector.x + (point_y - start.y) * boundary_vector.y) / length_squared, 0, 1)
+
+            distance = np.hypot(point_x - (start.x + boundary_vector.x * t), point_y - (start.y + boundary_vector.y * t))
+
+            window = unsigned[min_row:max_row + 1, min_column:max_column + 1]
+            closer = distance < window
+            window[closer] = distance[closer]
+            self.__nearest[min_row:max_row + 1, min_column:max_column + 1][closer] = i
+
+        self.__distance = unsigned - Config.BOUNDARY_RADIUS
+
+        gradient_y, gradient_x = np.gradient(self.__distance, self.__resolution)
+        self.__gradient = np.stack([gradient_x, gradient_y], axis=2)
+
+    def sample(self, pos):
+        fx = min(max(pos[0] / self.__resolution, 0), self.__columns - 1)
+        fy = min(max(pos[1] / self.__resolution, 0), self.__rows - 1)
+        column, row = int(fx), int(fy)
+        next_column, next_row = min(column + 1, self.__columns - 1), min(row + 1, self.__rows - 1)
+        tx, ty = fx - column, fy - row
+
+        weights = ((row, column, (1 - tx) * (1 - ty)), (row, next_column, tx * (1 - ty)),
+                   (next_row, column, (1 - tx) * ty), (next_row, next_column, tx * ty))
+
+        distance = 0
+        gradient_x = 0
+        gradient_y = 0
+        for r, c, weight in weights:
+            distance += self.__distance[r, c] * weight
+            gradient_x += self.__gradient[r, c, 0] * weight
+            gradient_y += self.__gradient[r, c, 1] * weight
+
+        nearest = self.__nearest[int(round(fy)), int(round(fx))]
+        boundary = self.__boundaries[nearest] if nearest >= 0 else None
+
+        return distance, pyg.math.Vector2(gradient_x, gradient_y), boundary
+
+    def to_arrays(self):
+        return {"resolution": self.__resolution, "distance": self.__distance, "gradient": self.__gradient, "nearest": self.__nearest}
+
+    @staticmethod
+    def sample_arrays(field, points):
+        # Bilinear sample of a field from to_arrays at (n, 2) points
+        rows, columns = field["distance"].shape
+        fx = np.clip(points[:, 0] / field["resolution"], 0, columns - 1)
+        fy = np.clip(points[:, 1] / field["resolution"], 0, rows - 1)
+        column = fx.astype(np.int64)
+        row = fy.astype(np.int64)
+        next_column = np.minimum(column + 1, columns - 1)
+        next_row = np.minimum(row + 1, rows - 1)
+        tx = (fx - column)[:, None]
+        ty = (fy - row)[:, None]
+
+        def bilinear(values):
+            return ((values[row, column] * (1 - tx) + values[row, next_column] * tx) * (1 - ty) +
+                    (values[next_row, column] * (1 - tx) + values[next_row, next_column] * tx) * ty)
+
+        distance = bilinear(field["distance"][:, :, None])[:, 0]
+        gradient = bilinear(field["gradient"])
+        nearest = field["nearest"][np.rint(fy).astype(np.int64), np.rint(fx).astype(np.int64)]
+
+        return distance, gradient, nearest
+
+    def get_resolution(self):
+        return self.__resolution
+
+class BoundaryIndex:
+    def __init__(self, cell_size):
+        self.__cell_size = cell_size
+        self.__cells = {}
+
+        # Insertion order of each boundary so queries return them in container order
+        self.__order = {}
+        self.__next_order = 0
+
+    def __cell_range(self, min_point, max_point):
+        min_x, min_y = int(min_point[0] // self.__cell_size), int(min_point[1] // self.__cell_size)
+        max_x, max_y = int(max_point[0] // self.__cell_size), int(max_point[1] // self.__cell_size)
+
+        return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+    def __bounds(self, boundary):
+        points = boundary.get_expanded_points()
+        min_point = (min(point.x for point in points), min(point.y for point in points))
+        max_point = (max(point.x for point in points), max(point.y for point in points))
+
+        return min_point, max_point
+
+    def clear(self):
+        self.__cells = {}
+        self.__order = {}
+        self.__next_order = 0
+
+    def build(self, boundaries):
+        self.clear()
+
+        for boundary in boundaries:
+            self.insert(boundary)
+
+    def insert(self, boundary):
+        self.__order[boundary] = self.__next_order
+        self.__next_order += 1
+
+        for key in self.__cell_range(*self.__bounds(boundary)):
+            if key in self.__cells:
+                self.__cells[key].append(boundary)
+            else:
+                self.__cells[key] = [boundary]
+
+    def remove(self, boundary):
+        if boundary not in self.__order:
+            return
+
+        self.__order.pop(boundary)
+        for key in self.__cell_range(*self.__bounds(boundary)):
+            if key in self.__cells and boundary in self.__cells[key]:
+                self.__cells[key].remove(boundary)
+
+                if not self.__cells[key]:
+                    self.__cells.pop(key)
+
+    def query_point(self, pos):
+        key = (int(pos[0] // self.__cell_size), int(pos[1] // self.__cell_size))
+        return self.__cells.get(key, [])
+
+    def query_rect(self, min_point, max_point):
+        found = set()
+        for key in self.__cell_range(min_point, max_point):
+            found.update(self.__cells.get(key, []))
+
+        return sorted(found, key=lambda boundary: self.__order[boundary])
+
+    def query_segment(self, start, end):
+        return self.query_rect((min(start[0], end[0]), min(start[1], end[1])), (max(start[0], end[0]), max(start[1], end[1])))
+
+    def to_arrays(self, boundaries):
+        # Dense CSR layout of the grid, walls are stored as indices into boundaries
+        if not self.__cells:
+            return np.zeros(2, dtype=np.int64), np.zeros(2, dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        positions = {boundary: i for i, boundary in enumerate(boundaries)}
+        keys = np.array(list(self.__cells.keys()), dtype=np.int64)
+        origin = keys.min(axis=0)
+        size = keys.max(axis=0) - origin + 1
+
+        cell_lists = [[] for i in range(int(size[0] * size[1]))]
+        for (x, y), cell in self.__cells.items():
+            cell_lists[(x - origin[0]) * size[1] + (y - origin[1])] = sorted(positions[boundary] for boundary in cell if boundary in positions)
+
+        cell_starts = np.zeros(len(cell_lists) + 1, dtype=np.int64)
+        cell_starts[1:] = np.cumsum([len(cell) for cell in cell_lists])
+        cell_walls = np.array([wall for cell in cell_lists for wall in cell], dtype=np.int64)
+
+        return origin, size, cell_starts, cell_walls
+
+    def get_cell_size(self):
+        return self.__cell_size
+
 class Helper:
     @staticmethod
     def lines_intersect(p1, p2, p3, p4):
@@ -1836,15 +4336,79 @@ class Helper:
         y = y1 + ua * (y2 - y1)
 
         return pyg.Vector2(x, y)
+
+    @staticmethod
+    def batch_lines_intersect(p1, p2, p3, p4, pairwise=False):
+        # Array version of lines_intersect, every motion segment p1->p2 (m, 2) against every wall p3->p4 (k, 2)
+        # giving (m, k) hit mask, ua and (m, k, 2) points, or row by row for equal length inputs when pairwise
+        p1, p2, p3, p4 = (np.asarray(p, dtype=np.float64) for p in (p1, p2, p3, p4))
+        if not pairwise:
+            p1, p2 = p1[:, None, :], p2[:, None, :]
+            p3, p4 = p3[None, :, :], p4[None, :, :]
+
+        motion = p1 - p2
+        edge = p3 - p4
+        offset = p1 - p3
+
+        den = motion[..., 0] * edge[..., 1] - motion[..., 1] * edge[..., 0]
+        valid = den != 0
+        safe_den = np.where(valid, den, 1)
+
+        ua = (offset[..., 0] * edge[..., 1] - offset[..., 1] * edge[..., 0]) / safe_den
+        ub = ((p2[..., 0] - p1[..., 0]) * offset[..., 1] - (p2[..., 1] - p1[..., 1]) * offset[..., 0]) / safe_den
+
+        hit = valid & (ua >= 0) & (ua <= 1) & (ub >= 0) & (ub <= 1)
+        points = p1 + ua[..., None] * (p2 - p1)
+
+        return hit, ua, points
+
+    @staticmethod
+    def segment_arrays(walls):
+        starts = np.array([(wall.get_pos()[0].x, wall.get_pos()[0].y) for wall in walls], dtype=np.float64).reshape(len(walls), 2)
+        ends = np.array([(wall.get_pos()[1].x, wall.get_pos()[1].y) for wall in walls], dtype=np.float64).reshape(len(walls), 2)
+
+        return starts, ends
         
     @staticmethod
     def clear_path(node_a, node_b, walls):
-        for wall in walls:
-            if Helper.lines_intersect(node_a.get_pos(), node_b.get_pos(), wall.get_pos()[0], wall.get_pos()[1]) is not None:
-                return False
-            
-        return True
+        if not walls:
+            return True
+
+        starts, ends = Helper.segment_arrays(walls)
+        hit, ua, points = Helper.batch_lines_intersect([tuple(node_a.get_pos())], [tuple(node_b.get_pos())], starts, ends)
+
+        return not hit.any()
             
 if __name__ == '__main__':
-    sim = Sim()
-    sim.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Boids evacuation simulation")
+    parser.add_argument("--headless", metavar="MAP", help="run a saved map without a window and print the results")
+    parser.add_argument("--steps", type=int, default=None, help="number of steps to run, defaults to until every boid arrives")
+    parser.add_argument("--engine", choices=["object", "numpy", "parallel"], default=Config.ENGINE)
+    parser.add_argument("--navigation", choices=["graph", "flow_field"], default=Config.NAVIGATION)
+    parser.add_argument("--wall-avoidance", choices=["geometric", "distance_field"], default=Config.WALL_AVOIDANCE)
+    parser.add_argument("--step-timing", action="store_true", default=Config.STEP_TIMING, help="time each phase of the step and report p50/p95/max")
+    parser.add_argument("--profile", type=int, metavar="STEPS", help="profile the first STEPS headless steps with cProfile")
+    args = parser.parse_args()
+
+    if args.headless:
+        sim = Sim(headless=True)
+        sim.set_engine(args.engine)
+        sim.set_navigation(args.navigation)
+        sim.set_wall_avoidance(args.wall_avoidance)
+        sim.set_step_timing(args.step_timing)
+
+        results = sim.run_headless(args.headless, args.steps, args.profile)
+        results.pop("positions", None)
+        print(json.dumps(results, indent=2))
+
+        if sim.get_step_timer() is not None:
+            print(sim.get_step_timer().format_stats(), file=sys.stderr)
+
+        sim.close()
+    else:
+        sim = Sim()
+        sim.set_engine(args.engine)
+        sim.set_navigation(args.navigation)
+        sim.set_wall_avoidance(args.wall_avoidance)
+        sim.set_step_timing(args.step_timing)
+        sim.run()
\ No newline at end of file